@@ -0,0 +1 @@
+# the repository root on sys.path, so the tests can import src
@@ -0,0 +1,58 @@
+import argparse
+
+from src.cache import load_conll
+from src.stats import LENGTH_THRESHOLDS, ApproxDatasetAnalysis, DatasetAnalysis
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Statistics of a conll dataset")
+    parser.add_argument("path", help="conll file (eg. dataset.conll or .conll.gz)")
+    parser.add_argument(
+        "--approx",
+        action="store_true",
+        help="stream the file and estimate with sketches, in bounded memory",
+    )
+    parser.add_argument("--sep", default=" ", help="column separator")
+    parser.add_argument(
+        "--length-thresholds",
+        type=int,
+        nargs="+",
+        default=list(LENGTH_THRESHOLDS),
+        help="count the sentences longer than each threshold",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=10000, help="sentences read at a time (approx)"
+    )
+    parser.add_argument(
+        "--examples", type=int, default=3, help="example sentences per entity (approx)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sketches")
+    parser.add_argument("--output", help="also write the statistics to this file")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.approx:
+        analysis = ApproxDatasetAnalysis(
+            args.path,
+            sep=args.sep,
+            length_thresholds=args.length_thresholds,
+            batch_size=args.batch_size,
+            n_examples=args.examples,
+            seed=args.seed,
+        )
+        text = analysis.generate_dataset_info()
+    else:
+        analysis = DatasetAnalysis(
+            df=load_conll(args.path, sep=args.sep),
+            length_thresholds=args.length_thresholds,
+        )
+        text = analysis.generate_dataset_info(is_alldata=True)
+
+    print("".join(text))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.writelines(text)
@@ -7,12 +7,12 @@
 import os
 
 import hydra
-from omegaconf import DictConfig, OmegaConf
-from sklearn.model_selection import KFold
+from omegaconf import DictConfig
 
 import src.dataset_preprocessing as preprocessing
-from src import utils
-from src.balanceamento import balance_from_conll
+from src import folds, utils
+from src.cache import StepCache, load_conll
+from src.shards import expand_files, load_conll_files
 from src.stats import DatasetAnalysis
 from src.utils import fix_seed
 
@@ -30,23 +30,51 @@ def main(config: DictConfig):
     random_state = config["UTILS"].get("random_state", 0)
     fix_seed(random_state)
 
-    FILENAME = os.path.join(config["DATASET"]["folder"], config["DATASET"]["filename"])
-
     N_KFOLD = config["KFOLD"].get("n_fold", 5)  # DEFAULT VALUE OF 5
     # _ because of gitignore
     SAVE_FOLDER = config["SAVE"].get("save_folder", "output_folder")
+    # compress the fold files, e.g. gzip -> train.conll.gz - DEFAULT None
+    COMPRESSION = config["SAVE"].get("compression")
+    assert (
+        COMPRESSION is None or COMPRESSION in utils.COMPRESSION_EXTENSIONS
+    ), f"Unknown compression {COMPRESSION}"
+    # write the corpus once and only sentence ids per fold
+    INDEX_ONLY = config["SAVE"].get("index_only", False)
+    # NO PARQUET OR COMPRESSION WITH index_only (NO FOLD FILES)
+    folds.check_save_config(config["SAVE"])
 
     # assert the version do not exists
     assert os.path.exists(SAVE_FOLDER) is False, "The version already exists"
     os.makedirs(SAVE_FOLDER)
 
     print("Loading Dataset")
-    df = utils.conll2pandas(FILENAME)  # LOAD THE DATASET FROM CONLL FILE
+    CACHE_DIR = config["DATASET"].get("cache_dir")
+    CACHE_MAX_SIZE_MB = config["DATASET"].get("cache_max_size_mb", 2048)
+    SHARDS = config["DATASET"].get("files")
+
+    if SHARDS:
+        # MANY CONLL SHARDS (GLOB OR LIST) PARSED IN PARALLEL
+        # THE SHARD OF EACH SENTENCE IS KEPT IN corpus.source_file
+        corpus = load_conll_files(
+            SHARDS if isinstance(SHARDS, str) else list(SHARDS),
+            folder=config["DATASET"]["folder"],
+            cache_dir=CACHE_DIR,
+            max_size_mb=CACHE_MAX_SIZE_MB,
+            n_jobs=config["DATASET"].get("n_jobs"),
+        )
+    else:
+        # LOAD THE DATASET FROM CONLL FILE (OR FROM THE PARSE CACHE)
+        FILENAME = os.path.join(
+            config["DATASET"]["folder"], config["DATASET"]["filename"]
+        )
+        corpus = load_conll(FILENAME, cache_dir=CACHE_DIR, max_size_mb=CACHE_MAX_SIZE_MB)
     print("Dataset loaded")
 
     # ---------------------- ALL DATA ANALYSIS ----------------------
 
-    analysis_fulldataset = DatasetAnalysis(df=df)
+    analysis_fulldataset = DatasetAnalysis(
+        df=corpus, length_thresholds=folds.length_thresholds(config)
+    )
     stats = analysis_fulldataset.generate_dataset_info(is_alldata=True)
     with open(os.path.join(SAVE_FOLDER, "stats_full.txt"), "w", encoding="utf-8") as f:
         f.writelines(stats)
@@ -62,130 +90,64 @@ def main(config: DictConfig):
     # FILTER TAGS WITH MINIMUM RATIO # removendo abaixo de 0.5%
     # df = utils.filter_entities(df, minimum_entity_ratio=0.005)
 
-    # FILTER SENTENCES WITH ENTITIES
-    tags_to_remove = config["PREPROCESSING"].get("fill_O_tags", "")
-    if tags_to_remove:
-        df = preprocessing.fill_O_tags(df, tags_to_remove)
-
-    # Datas_do_contrato e Datas_dos_fatos PARA Datas
-    datas_to_change = config["PREPROCESSING"].get("datas_aggregation")
-    if datas_to_change:
-        print("Datas Aggretation to Generic Datas", datas_to_change)
-        # hardcoded due to business decision
-        df = preprocessing.datas_change(df, datas_to_change=datas_to_change)
-
-    if config["PREPROCESSING"].get("remove_jurisprudencia_sentence", False):
-        print("Remove Jurisprudência")
-        # REMOVE JURISPRUDENCIA
-        df = preprocessing.remove_jurisprudencia_sentence(df)
-
-    # A MUST STEP
-    # FILTER MAX_LENGHT SENTENCES
-    df = preprocessing.trucate_sentence_max_length(
-        df, max_length=config["PREPROCESSING"].get("max_length_sentence", 256)
-    )
-
-    # UNDERSAMPLING SENTENCES WITH FULL 'O' TAGS
-    # ONLY IN TRAIN
-    if config["PREPROCESSING"].get("undersampling_negative_sentences"):
-        print("UNDERSAMPLING NEGATIVE SENTENCES")
-        df = preprocessing.undersampling_negative_sentences(
-            df,
-            ratio_to_remove=config["PREPROCESSING"].get(
-                "ratio_of_undersample_negative_sentences", 0.8
-            ),
-        )
-
-    # UNDERSAMPLING TAGs
-    undersampling_tags = config["PREPROCESSING"].get("undersampling_tags")
-    if undersampling_tags:
-        print("Undersampling tags ", undersampling_tags)
-        df = preprocessing.undersampling_entity(
-            df,
-            undersampling_tags=undersampling_tags,
-            ratio_to_remove=config["PREPROCESSING"].get(
-                "ratio_of_undersample_tags", 0.5
-            ),
-        )
+    # FILL O TAGS, DATAS AGGREGATION, REMOVE JURISPRUDENCIA, MAX_LENGTH TRUNCATION
+    # AND UNDERSAMPLING (NEGATIVE SENTENCES AND TAGS) IN A SINGLE PASS
+    pipeline = preprocessing.PreprocessingPipeline.from_config(config["PREPROCESSING"])
+    # OUTPUT OF EACH STAGE CACHED, A RERUN RESUMES FROM THE LAST UNCHANGED STAGE
+    STEP_CACHE_DIR = config["DATASET"].get("preprocessing_cache_dir")
+    step_cache = input_key = None
+    if STEP_CACHE_DIR:
+        step_cache = StepCache(STEP_CACHE_DIR, max_size_mb=CACHE_MAX_SIZE_MB)
+        # KEYED BY THE CONTENT OF THE CONLL FILES, NOT BY HASHING THE CORPUS
+        if SHARDS:
+            paths = [
+                os.path.join(config["DATASET"]["folder"], shard)
+                for shard in expand_files(
+                    SHARDS if isinstance(SHARDS, str) else list(SHARDS),
+                    folder=config["DATASET"]["folder"],
+                )
+            ]
+        else:
+            paths = [FILENAME]
+        input_key = step_cache.source_key(paths)
+    corpus = pipeline.run(corpus, cache=step_cache, input_key=input_key)
+    # WITH SHARDS, df ALSO HAS THE source_file COL
+    df = corpus.to_pandas().reset_index(drop=True)
+
+    # SAME TAG ID -> TAG NAME VOCABULARY FOR ALL THE PARQUET FOLDS
+    parquet_tag_names = None
+    if config["SAVE"].get("parquet_tags_as_ids", False):
+        parquet_tag_names = sorted(corpus.used_tag_names)
+
+    if INDEX_ONLY:
+        print("Saving preprocessed corpus")
+        folds.save_corpus(df, SAVE_FOLDER)
 
     print("SPLITS into FOLDS")
 
     # --------------- SPLIT IN K FOLDS AND GENERATE ANALYSIS ----------
-    # KFOLD
-    kf = KFold(n_splits=N_KFOLD, random_state=random_state, shuffle=True)
-
-    for i, (train_index, test_index) in enumerate(kf.split(df)):
-        save_path = SAVE_FOLDER + "/" + "fold-" + str(i) + "/"  # PATH TO SAVE
-        os.makedirs(save_path)  # CREATE THE FOLDER VERSION AND SUBFOLDER
-
-        # get the data from indexes
-        train_data, test_data = df.loc[train_index], df.loc[test_index]
-
-        # FOLD ANALYSIS
-        stats = []
-        analysis_train = DatasetAnalysis(df=train_data)
-        analysis_test = DatasetAnalysis(df=test_data)
-        stats.extend(
-            analysis_train.generate_dataset_info(n_fold=i, train_data=True)
-        )  # TRAIN DATA
-        stats.extend(
-            analysis_test.generate_dataset_info(n_fold=i, train_data=False)
-        )  # TEST DATA
-        # save stats
-
-        # SAVE KFOLD SPLIT DATASET
-        # SAVE IN CONLL
-        if config["SAVE"].get("save_into_conll", True):
-            utils.pandas2conll(train_data, save_path + "train.conll")
-            utils.pandas2conll(test_data, save_path + "dev.conll")
-        # SAVE IN JSON
-        if config["SAVE"].get("save_into_json", True):
-            utils.pandas2json(train_data, save_path + "train.json")
-            utils.pandas2json(test_data, save_path + "dev.json")
-
-        if config["PREPROCESSING"].get("balance_folds", True):
-            print("BALANCING FOLD")
-            # BALANCE AND REWRITE CONLL FILES
-            train_data, test_data = balance_from_conll(
-                save_path + "train.conll", save_path + "dev.conll"
-            )
-
-            # SAVE BALANCED DATASET
-            # SAVE IN CONLL
-            utils.pandas2conll(train_data, save_path + "train.conll")
-            utils.pandas2conll(test_data, save_path + "dev.conll")
-            # SAVE IN JSON
-            utils.pandas2json(train_data, save_path + "train.json")
-            utils.pandas2json(test_data, save_path + "dev.json")
-
-            stats.append("*" * 15)
-            stats.append("STATS WITH FOLDS BALANCED")
-            stats.append("*" * 15 + "\n")
-
-            analysis_train = DatasetAnalysis(df=train_data)
-            analysis_test = DatasetAnalysis(df=test_data)
-            stats.extend(
-                analysis_train.generate_dataset_info(n_fold=i, train_data=True)
-            )  # TRAIN DATA
-            stats.extend(
-                analysis_test.generate_dataset_info(n_fold=i, train_data=False)
-            )  # TEST DATA
-
-        with open(os.path.join(save_path, "stats.txt"), "w", encoding="utf-8") as f:
-            f.writelines(stats)
-
-        print(f"Save dataset and stats for fold-{i}")
-
-        with open(
-            os.path.join(save_path, "preprocessing_snapshot.yaml"),
-            "w",
-            encoding="utf-8",
-        ) as f:
-            f.writelines(OmegaConf.to_yaml(config["PREPROCESSING"]))
-
-        if config["SAVE"].get("save_only_first_fold", True):
-            print("SAVING ONLY FOLD 0")
-            break
+    # GROUPED BY ORIGINAL SENTENCE: THE WINDOWS OF A SENTENCE SHARE A FOLD
+    splits = folds.split_folds(
+        df,
+        groups=corpus.index,
+        n_splits=N_KFOLD,
+        strategy=config["KFOLD"].get("strategy", "kfold"),
+        random_state=random_state,
+    )
+    if config["SAVE"].get("save_only_first_fold", True):
+        print("SAVING ONLY FOLD 0")
+        splits = splits[:1]
+
+    # STATS, BALANCING AND FILES OF EACH FOLD, IN PARALLEL WITH KFOLD.n_jobs != 1
+    folds.run_folds(
+        df,
+        splits,
+        SAVE_FOLDER,
+        config,
+        n_jobs=config["KFOLD"].get("n_jobs", 1),
+        tag_names=parquet_tag_names,
+        groups=corpus.index,
+    )
 
     print("Done!")
 
@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
-from src import utils
-from sklearn.model_selection import train_test_split
+from src.corpus import Corpus
+from src.entity_index import EntityIndex
 
 redator = ['B-Valor_dano_moral',
            'B-Data_do_contrato',
@@ -20,20 +21,32 @@ auxiliar = ['B-Valor_danos_materiais/restituição_em_dobro',
             'B-CPF']
 
 
-def __find_indexes_from_label(dataset, label, tags_column='tags'):
-    """Encontra todas as ocorrências de uma label
-    em um dataset.
+# grupos de entidades e proporção alvo de cada entidade no dataset de treino
+# usados por 'balance_global' quando nenhum grupo é informado
+default_entity_groups = {
+    'redator': {'entities': redator, 'target_ratio': 0.7},
+    'auxiliar': {'entities': auxiliar, 'target_ratio': 0.7},
+}
+
+
+def __as_corpus(data):
+    """Retorna 'data' caso já seja um Corpus, ou faz o parse do arquivo conll.
+
+    O Corpus expõe as duas visões usadas no balanceamento: token -> tag
+    (Corpus.token_view) e sentença -> list<tag> (Corpus.to_pandas), ambas
+    construídas sem reler o arquivo.
     """
-    relevant_indexes = []
-    for row in range(dataset.shape[0]):
-        # encontra as tags da linha
-        tags = dataset.iloc[row][tags_column]
+    if isinstance(data, Corpus):
+        return data
 
-        # checa se 'label' é uma das tags
-        if label in tags:
-            relevant_indexes.append(row)
+    return Corpus.from_conll(data)
 
-    return relevant_indexes
+
+def __sentence_view(corpus):
+    """Dataframe sentença -> list<tag> de um Corpus, indexado pelo índice
+    original das sentenças (preservado pelas transferências).
+    """
+    return corpus.to_pandas()
 
 
 def __split_percents(entidades_train, entidades_test):
@@ -162,50 +175,34 @@ def __count_entities(dataset, entities):
     return entity_count
 
 
-def __balance_entity(destination, source, qtd, entity, normalize_qtd=True):
-    """Transfere dado número de ocorrências de uma entidade
-    do dataset de origem (source) para o dataset de destino (destination).
-
-    Por padrão, o valor 'qtd' será normalizado para um valor positivo para
-    garantir que o número de entidades transferida permaneça o mesmo.
-
-    Passar um valor negativo de 'qtd' e inicializar a variável 'normalize_qtd'
-    como 'False' fará com que sejam transferidas 'n - qtd' ocorrências para o
-    dataset de destino (onde 'n' é o número total de ocorrências).
-
-    Exemplo: caso existam 7 ocorrências de 'entity' em 'source':
-        qtd = 2, normalize_qtd = True -> 2 entidades transferidas
-        qtd = 2, normalize_qtd = False -> 2 entidades transferidas
-        qtd = -2, normalize_qtd = True -> 2 entidades transferidas
-        qtd = -2, normalize_qtd = False -> 5 entidades transferidas
-    """
-    if normalize_qtd:
-        qtd = abs(qtd)
+def __balance_entity(in_train, order, has_entity, qtd, to_train):
+    """Transfere as 'qtd' primeiras sentenças (na ordem atual do dataset de
+    origem) que contêm uma entidade para o outro dataset.
 
-    # encontra os índices de ocorrências que possuem uma entidade em específico
-    correcao_index = __find_indexes_from_label(source, entity)[:qtd]
+    A função não copia dataframes: ela apenas atualiza, in-place, o estado
+    mantido por '__realizar_correcao'. As sentenças transferidas vão para o
+    final do dataset de destino, na mesma ordem em que estavam na origem.
+    O valor de 'qtd' é normalizado para um valor positivo.
 
-    for index in correcao_index:
-        try:
-            # utiliza iloc() para pegar a linha correspondentes no dataset origem
-            row = source.iloc[index]
+    Parâmetros
+    ----------
+    in_train : np.ndarray<bool>
+        True para as sentenças que estão no dataset de treino.
 
-            # tenta remover a linha no dataset original
-            source = source.drop(index)
-            #print(f"Dropped index: {index}")
+    order : np.ndarray<int>
+        Ordem de cada sentença dentro do seu dataset.
 
-            # tenta adicionar a linha no dataset de destino
-            # esse comando só será executado caso a linha ainda não tenha sido transferida
-            destination = pd.concat(
-                [destination, pd.DataFrame([row])], ignore_index=True)
+    has_entity : np.ndarray<bool>
+        True para as sentenças que contêm a entidade.
 
-        except KeyError:
-            # falha ao remover uma linha, normalmente por que a linha já foi removida
-            # (2 tags que devem ser balanceadas presentes na mesma linha)
-            #print(f"The index {index} was already dropped!")
-            pass
+    to_train : bool
+        True para transferir de test para train, False de train para test.
+    """
+    source = np.flatnonzero(has_entity & (in_train != to_train))
+    moved = source[np.argsort(order[source], kind='stable')][:abs(qtd)]
 
-    return destination, source
+    in_train[moved] = to_train
+    order[moved] = order.max() + 1 + np.arange(len(moved))
 
 
 def __realizar_correcao(dataset_train, dataset_test, contagem_correcao, nomes_entidades):
@@ -241,18 +238,59 @@ def __realizar_correcao(dataset_train, dataset_test, contagem_correcao, nomes_en
     -------
     Retorna uma tupla contendo os subsets modificados.
     """
+    # todas as sentenças, treino seguido de test
+    dataset = pd.concat([dataset_train, dataset_test])
+    in_train = np.arange(len(dataset)) < len(dataset_train)
+    order = np.arange(len(dataset))
+
+    # índice invertido entidade -> sentenças, construído uma única vez
+    entity_index = EntityIndex.from_pandas(dataset)
+
     for correcao, entidade in zip(contagem_correcao, nomes_entidades):
-        # passa amostras de treino pra test
-        if correcao > 0:
-            dataset_test, dataset_train = __balance_entity(dataset_test, dataset_train,
-                                                           correcao, entidade)
+        if correcao == 0:
+            continue
+
+        has_entity = entity_index.mask(entidade)
+
+        # correcao > 0: passa amostras de treino pra test
+        # correcao < 0: passa amostras de test pra treino
+        __balance_entity(in_train, order, has_entity, correcao, to_train=correcao < 0)
+
+    # aplica todas as transferências de uma só vez
+    return __partition(dataset, in_train, order)
+
 
-        # passa amostras de test pra treino
-        elif correcao < 0:
-            dataset_train, dataset_test = __balance_entity(dataset_train, dataset_test,
-                                                           correcao, entidade)
+def __partition(dataset, in_train, order):
+    """Separa 'dataset' em (train, test) segundo 'in_train', com as sentenças
+    de cada subset ordenadas por 'order'."""
+    train_rows = np.flatnonzero(in_train)
+    test_rows = np.flatnonzero(~in_train)
 
-    return dataset_train, dataset_test
+    return (dataset.iloc[train_rows[np.argsort(order[train_rows], kind='stable')]],
+            dataset.iloc[test_rows[np.argsort(order[test_rows], kind='stable')]])
+
+
+def __count_from_index(entity_index, in_train, entities):
+    """Conta o número de ocorrências de cada entidade em 'entities' nos datasets
+    de treino e test, a partir do índice invertido entidade -> sentenças.
+
+    Equivalente a '__count_entities' aplicada aos dois datasets, sem construir o
+    dataframe token -> tag.
+
+    Retorno
+    -------
+    entidades_train : list<int>
+
+    entidades_test : list<int>
+    """
+    entidades_train, entidades_test = [], []
+    for entity in entities:
+        sentences, counts = entity_index.sentences(entity), entity_index.counts(entity)
+        train = int(counts[in_train[sentences]].sum())
+        entidades_train.append(train)
+        entidades_test.append(int(counts.sum()) - train)
+
+    return entidades_train, entidades_test
 
 
 def balance_from_dataframe(train_dataframe, test_dataframe):
@@ -260,7 +298,11 @@ def balance_from_dataframe(train_dataframe, test_dataframe):
     dataframes.
 
     Espera-se que os dataframes recebidos contenham colunas 'text' e 'tags', e que
-    esteja no formato "sentença -> list<tag>"
+    esteja no formato "sentença -> list<tag>". As ocorrências de cada entidade são
+    contadas diretamente das listas de tags, sem arquivos conll intermediários.
+
+    As entidades redator são balanceadas primeiro; as entidades auxiliar são
+    contadas e balanceadas sobre o resultado do balanceamento das entidades redator.
 
     A função não modifica os dataframes passados como argumento.
     Para garantir que eles sejam modificados, deve-se armazenar o valor de retorno da função.
@@ -270,83 +312,72 @@ def balance_from_dataframe(train_dataframe, test_dataframe):
     balanced_train : pandas.DataFrame
 
     balanced_test : pandas.DataFrame
+    """
+    # todas as sentenças, treino seguido de test
+    dataset = pd.concat([train_dataframe, test_dataframe])
+    in_train = np.arange(len(dataset)) < len(train_dataframe)
+    order = np.arange(len(dataset))
 
-    TODO: Garantir que somente essa função precise ser chamada para realizar o balanceamento.
+    # índice invertido entidade -> sentenças, construído uma única vez
+    entity_index = EntityIndex.from_pandas(dataset)
 
+    for entities in (redator, auxiliar):
+        # Quantidade de entidades em cada dataset
+        entities_train, entities_test = \
+            __count_from_index(entity_index, in_train, entities)
 
-    FIXME: resolver o problema de dataframes diferentes (token -> tag vs sent -> list<tag>)
-    Se possível, refatorar todas as funções do módulo para operar em ambos os tipos, de forma
-    genérica.
-    Caso contrário, pelo menos criar funções que funcionem em um dataset "sent -> list<tag>"
-    """
+        # Distribuição e relevância das entidades por dataset
+        division_percent_train, division_percent_test, one_entity_percent = \
+            __split_percents(entities_train, entities_test)
+
+        # Vetor de correção
+        correction_values = __get_balancing_samples(division_percent_train,
+                                                    division_percent_test,
+                                                    one_entity_percent)
 
-    pass
+        for correcao, entidade in zip(correction_values, entities):
+            if correcao == 0:
+                continue
+            __balance_entity(in_train, order, entity_index.mask(entidade), correcao,
+                             to_train=correcao < 0)
 
+    # aplica todas as transferências de uma só vez
+    return __partition(dataset, in_train, order)
 
-def balance_from_conll(path_to_train: str, path_to_test: str):
+
+def balance_from_conll(path_to_train, path_to_test):
     """Balanceia um dataset com múltiplas classes (exemplo: dataset NER), a partir de
     arquivos conll.
 
-    Retorna um dataframe contendo colunas 'text' e 'tags', no formato "senteça -> list<tags>".
+    'path_to_train' e 'path_to_test' podem ser caminhos para arquivos conll ou
+    objetos Corpus já carregados; neste caso nenhum arquivo é lido.
+
+    Retorna um dataframe contendo colunas 'text' e 'tags', no formato "senteça -> list<tags>",
+    indexado pelo índice original de cada sentença (Corpus.index, ou a posição
+    da sentença no arquivo).
 
     Retorno
     -------
     balanced_train : pandas.DataFrame
 
     balanced_test : pandas.DataFrame
-
     """
-    # Dataframe token -> tag
-    train_dataframe_token_tag = utils.conll2pandas_group_by_token(
-        path_to_train)
-    test_dataframe_token_tag = utils.conll2pandas_group_by_token(path_to_test)
-
-    # Quantidade de entidades em cada dataset
-    entities_red_train = __count_entities(train_dataframe_token_tag, redator)
-    entities_aux_train = __count_entities(train_dataframe_token_tag, auxiliar)
-    entities_red_test = __count_entities(test_dataframe_token_tag, redator)
-    entities_aux_test = __count_entities(test_dataframe_token_tag, auxiliar)
-
-    # Distribuição e relevância das entidades redator e auxiliar por dataset
-    division_percent_train_red, division_percent_test_red, one_entity_percent_red = \
-        __split_percents(entities_red_train, entities_red_test)
-    division_percent_train_aux, division_percent_test_aux, one_entity_percent_aux = \
-        __split_percents(entities_aux_train, entities_aux_test)
-
-    # Vetores de correção
-    redator_correction_values = __get_balancing_samples(division_percent_train_red,
-                                                        division_percent_test_red,
-                                                        one_entity_percent_red)
-    auxiliar_correction_values = __get_balancing_samples(division_percent_train_aux,
-                                                         division_percent_test_aux,
-                                                         one_entity_percent_aux)
-
     # Dataset sentença -> list<tag>
-    train_dataframe_sent_tags = utils.conll2pandas(path_to_train)
-    test_dataframe_sent_tags = utils.conll2pandas(path_to_test)
+    train_dataframe_sent_tags = __sentence_view(__as_corpus(path_to_train))
+    test_dataframe_sent_tags = __sentence_view(__as_corpus(path_to_test))
 
-    # Balanceamento das entidades redator
-    dataset_train_balanced, dataset_dev_balanced = \
-        __realizar_correcao(train_dataframe_sent_tags,
-                            test_dataframe_sent_tags,
-                            redator_correction_values,
-                            redator)
-
-    # Balanceamento das entidades teste
-    dataset_train_balanced, dataset_dev_balanced = \
-        __realizar_correcao(train_dataframe_sent_tags,
-                            test_dataframe_sent_tags,
-                            auxiliar_correction_values,
-                            auxiliar)
-
-    return dataset_train_balanced, dataset_dev_balanced
+    return balance_from_dataframe(train_dataframe_sent_tags, test_dataframe_sent_tags)
 
 
-def balance_from_one_conll(data_path: str, test_size: float=0.2):
+def balance_from_one_conll(data_path, test_size: float=0.2):
     """Balanceia um dataset com múltiplas classes (exemplo: dataset NER), a partir de
     arquivos conll.
 
-    Retorna um dataframe contendo colunas 'text' e 'tags', no formato "senteça -> list<tags>".
+    'data_path' pode ser o caminho para um arquivo conll ou um Corpus já carregado.
+
+    Retorna um dataframe contendo colunas 'text' e 'tags', no formato "senteça -> list<tags>",
+    indexado pelo índice original de cada sentença (Corpus.index, ou a posição
+    da sentença no arquivo).
 
     Retorno
     -------
@@ -355,8 +386,13 @@ def balance_from_one_conll(data_path: str, test_size: float=0.2):
     balanced_test : pandas.DataFrame
 
     """
+    # sklearn só é importado aqui, o pipeline do main.py não o usa
+    from sklearn.model_selection import train_test_split
+
+    corpus = __as_corpus(data_path)
+
     # Dataframe token -> tag
-    df_token_tag = utils.conll2pandas_group_by_token(data_path)
+    df_token_tag = corpus.token_view()
 
     entities_list = [tag for tag in df_token_tag.tags.unique() if tag[:2]=='B-']
 
@@ -376,7 +412,7 @@ def balance_from_one_conll(data_path: str, test_size: float=0.2):
                                                 one_entity_percent)
 
     # Dataset sentença -> list<tag>
-    df_sent_tags = utils.conll2pandas(data_path)
+    df_sent_tags = __sentence_view(corpus)
 
     train_df_sent_tags, test_df_sent_tags = train_test_split(df_sent_tags, test_size=test_size)
 
@@ -388,3 +424,113 @@ def balance_from_one_conll(data_path: str, test_size: float=0.2):
                             entities_list)
 
     return dataset_train_balanced, dataset_dev_balanced
+
+
+def balance_global(train_dataframe, test_dataframe, entity_groups=None, max_moves=None):
+    """Balanceia train e test otimizando um único objetivo para todas as entidades.
+
+    Diferente de 'balance_from_conll', que corrige uma entidade por vez (e cujas
+    transferências desbalanceiam as outras entidades), esta função minimiza o
+    desbalanceamento global:
+
+        soma, para cada entidade e, de (train_e / total_e - target_ratio_e) ** 2
+
+    Todas as sentenças que contêm alguma entidade dos grupos são candidatas a
+    trocar de subset. Sentenças com a mesma contagem de entidades no mesmo subset
+    têm o mesmo efeito marginal no objetivo, então as candidatas são agrupadas por
+    perfil e, a cada passo, o efeito de todos os perfis é recalculado de uma vez
+    (um produto matriz-vetor) e a melhor troca é aplicada, enquanto reduzir o
+    objetivo. Dentro de um perfil, as sentenças trocam de subset na ordem em que
+    aparecem; cada sentença troca no máximo uma vez, e as sentenças transferidas
+    vão para o final do subset de destino.
+
+    Parâmetros
+    ----------
+    train_dataframe, test_dataframe : pandas.DataFrame
+        Dataframes com colunas 'text' e 'tags', no formato "sentença -> list<tag>".
+
+    entity_groups : dict
+        Grupos de entidades, no formato de BALANCING.entity_groups do settings.yaml:
+            {'redator': {'entities': ['B-Valor_dano_moral', ...], 'target_ratio': 0.7}}
+        Padrão: 'default_entity_groups' (listas redator e auxiliar).
+
+    max_moves : int
+        Número máximo de sentenças transferidas. Padrão: sem limite.
+
+    Retorno
+    -------
+    balanced_train : pandas.DataFrame
+
+    balanced_test : pandas.DataFrame
+
+    report : dict
+        Desbalanceamento antes ('before') e depois ('after') e o número de
+        sentenças transferidas ('moved').
+    """
+    entity_groups = entity_groups or default_entity_groups
+    entities, targets = [], []
+    for group in entity_groups.values():
+        entities.extend(group['entities'])
+        targets.extend([group.get('target_ratio', 0.7)] * len(group['entities']))
+
+    # todas as sentenças, treino seguido de test
+    dataset = pd.concat([train_dataframe, test_dataframe])
+    in_train = np.arange(len(dataset)) < len(train_dataframe)
+    order = np.arange(len(dataset))
+
+    # contagem de cada entidade em cada sentença
+    entity_index = EntityIndex.from_pandas(dataset)
+    counts = np.zeros((len(dataset), len(entities)))
+    for j, entity in enumerate(entities):
+        counts[entity_index.sentences(entity), j] = entity_index.counts(entity)
+
+    # somente entidades presentes entram no objetivo
+    total = counts.sum(axis=0)
+    present = total > 0
+    counts, total = counts[:, present], total[present]
+    targets = np.array(targets)[present]
+    train_ratio = counts[in_train].sum(axis=0) / total
+
+    def objective(ratio):
+        return float(((ratio - targets) ** 2).sum())
+
+    before = objective(train_ratio)
+
+    # perfis (contagem das entidades + subset) das sentenças candidatas
+    candidates = np.flatnonzero(counts.sum(axis=1) > 0)
+    profiles, profile_of = np.unique(
+        np.column_stack([counts[candidates], in_train[candidates]]),
+        axis=0, return_inverse=True)
+    profile_of = profile_of.reshape(-1)
+    # sentenças de cada perfil, na ordem do dataset
+    queues = [list(candidates[profile_of == p][::-1]) for p in range(len(profiles))]
+
+    # variação de train_ratio causada pela troca de uma sentença de cada perfil
+    delta = np.where(profiles[:, -1:] == 1, -1, 1) * profiles[:, :-1] / total
+    delta_squared = (delta ** 2).sum(axis=1)
+    available = np.ones(len(profiles), dtype=bool)
+
+    moved = 0
+    next_order = len(dataset)
+    while available.any() and (max_moves is None or moved < max_moves):
+        # efeito marginal de cada perfil: sum(d * (2 * (ratio - target) + d))
+        effects = delta @ (2 * (train_ratio - targets)) + delta_squared
+        effects[~available] = np.inf
+        best = int(np.argmin(effects))
+        if effects[best] >= -1e-12:
+            # nenhuma troca reduz mais o desbalanceamento
+            break
+
+        sentence = queues[best].pop()
+        available[best] = len(queues[best]) > 0
+
+        train_ratio = train_ratio + delta[best]
+        in_train[sentence] = not in_train[sentence]
+        order[sentence] = next_order
+        next_order += 1
+        moved += 1
+
+    report = {'before': before, 'after': objective(train_ratio), 'moved': moved}
+    balanced_train, balanced_test = __partition(dataset, in_train, order)
+
+    return balanced_train, balanced_test, report
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from src.corpus import Corpus
+
+# bump when the on-disk format of Corpus.save changes
+CACHE_VERSION = 1
+# bump when a preprocessing stage changes its output for the same config
+STEP_CACHE_VERSION = 2
+
+
+class ParseCache:
+    """On-disk cache of parsed conll files
+
+    Each entry is a `Corpus.save` folder named after the blake2b hash of the
+    file content, its size and the column separator, so the same corpus is
+    only parsed once no matter its path. The hash of each path is remembered
+    together with its size and mtime, so unchanged files are not rehashed.
+
+    When the cache grows over `max_size_mb`, the least recently used entries
+    are removed. An entry removed by another process while it is read is a
+    cache miss.
+
+    Args:
+        cache_dir (str): folder of the cache
+        max_size_mb (float, optional): size limit of the cache. Defaults to 2048.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb=2048):
+        assert max_size_mb > 0, "max_size_mb must be positive"
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, path: str, sep=" ", evict=True):
+        """Load the parsed conll file from the cache, parsing it on a miss
+
+        Args:
+            path (str): filename (eg. dataset.conll)
+            sep (str, optional): column separator. Defaults to ' '.
+            evict (bool, optional): evict after storing a new entry. Workers of
+                a pool pass False and the parent evicts once at the end, so
+                no entry is removed while another worker reads it.
+                Defaults to True.
+
+        Returns:
+            Corpus: the parsed corpus
+        """
+        entry = os.path.join(self.cache_dir, self.key(path, sep))
+
+        corpus = _load_entry(entry)
+        if corpus is not None:
+            return corpus
+
+        corpus = Corpus.from_conll(path, sep)
+        _store(corpus, entry)
+        if evict:
+            self.evict()
+
+        return corpus
+
+    def key(self, path: str, sep=" "):
+        """Cache key of a conll file: content hash, size, separator and version"""
+        stat = os.stat(path)
+        digest = self._digest(path, stat)
+        sep_digest = hashlib.blake2b(sep.encode("utf-8"), digest_size=4).hexdigest()
+
+        return f"{digest}-{stat.st_size}-{sep_digest}-v{CACHE_VERSION}"
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size"""
+        _evict(self.cache_dir, self.max_size)
+
+    def _digest(self, path, stat):
+        return _file_digest(path, stat, self.cache_dir)
+
+
+class StepCache:
+    """On-disk cache of the output of each preprocessing stage
+
+    The key of a stage chains the key of its input with the stage name and its
+    config slice, so a rerun that only changes the config of a late stage (eg.
+    ratio_of_undersample_tags) resumes from the output of the stage before it,
+    and a rerun with the same PREPROCESSING section loads the final output.
+    Entries are `Corpus.save` folders, evicted like the ParseCache (LRU).
+
+    The first key comes from the content digest of the parsed conll files
+    (`source_key`, remembered by size and mtime like the ParseCache), so an
+    unchanged input is not hashed again; `input_key` hashes a corpus that was
+    not read from files.
+
+        cache = StepCache(".cache/preprocessing")
+        key = cache.source_key(["dataset.conll"])
+        key = cache.key(key, "max_length", {"max_length_sentence": 256})
+        cache.get(key)  # None on a miss
+
+    Args:
+        cache_dir (str): folder of the cache
+        max_size_mb (float, optional): size limit of the cache. Defaults to 2048.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb=2048):
+        assert max_size_mb > 0, "max_size_mb must be positive"
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_key(self, paths, sep=" "):
+        """Key of the corpus parsed from the conll files `paths` (in order)"""
+        h = hashlib.blake2b(digest_size=16)
+        for path in paths:
+            h.update(_file_digest(path, os.stat(path), self.cache_dir).encode("utf-8"))
+        h.update(sep.encode("utf-8"))
+
+        return f"{h.hexdigest()}-v{CACHE_VERSION}"
+
+    def input_key(self, corpus, chunk_size=1 << 16):
+        """Key of a corpus from its content (tokens, tags, offsets and index)
+
+        The numeric arrays are hashed from their buffers and the tokens in
+        chunks, so no copy of the corpus is made.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        for start in range(0, len(corpus.tokens), chunk_size):
+            chunk = corpus.tokens[start : start + chunk_size].tolist()
+            h.update("\n".join(chunk).encode("utf-8"))
+        h.update("\n".join(corpus.tag_names.tolist()).encode("utf-8"))
+        for array in (corpus.tag_ids, corpus.offsets, corpus.index):
+            if array is not None:
+                array = np.ascontiguousarray(array)
+                h.update(array.dtype.str.encode("utf-8"))
+                h.update(memoryview(array).cast("B"))
+
+        return h.hexdigest()
+
+    def key(self, input_key: str, stage: str, config: dict):
+        """Key of the output of `stage` with `config` applied to `input_key`"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(input_key.encode("utf-8"))
+        h.update(stage.encode("utf-8"))
+        h.update(json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+        return f"{stage}-{h.hexdigest()}-v{CACHE_VERSION}.{STEP_CACHE_VERSION}"
+
+    def get(self, key: str):
+        """The cached Corpus, None on a miss"""
+        return _load_entry(os.path.join(self.cache_dir, key))
+
+    def put(self, key: str, corpus):
+        """Store a stage output and evict the least recently used entries"""
+        _store(corpus, os.path.join(self.cache_dir, key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size"""
+        _evict(self.cache_dir, self.max_size)
+
+
+def _file_digest(path, stat, cache_dir):
+    """blake2b of the file content, remembered in cache_dir/hashes.json with the
+    size and mtime of the file, so an unchanged file is not hashed again"""
+    index_path = os.path.join(cache_dir, "hashes.json")
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    signature = [stat.st_size, stat.st_mtime_ns]
+    known = hashes.get(os.path.abspath(path))
+    if known and known["signature"] == signature:
+        return known["digest"]
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    hashes[os.path.abspath(path)] = {"signature": signature, "digest": digest}
+    tmp = f"{index_path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(hashes, f)
+    os.replace(tmp, index_path)
+
+    return digest
+
+
+def _load_entry(entry):
+    """The Corpus of a cache folder, None when it does not exist or is removed
+    (by an eviction in another process) while it is read"""
+    try:
+        os.utime(entry)  # LRU
+        return Corpus.load(entry)
+    except FileNotFoundError:
+        return None
+
+
+def _store(corpus, entry):
+    """Save the corpus in the cache folder `entry`, atomically"""
+    tmp = f"{entry}.tmp-{os.getpid()}"
+    corpus.save(tmp)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # another process stored the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _evict(cache_dir, max_size):
+    """Remove the least recently used entries of cache_dir until it fits max_size"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry) or ".tmp-" in name:
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        except FileNotFoundError:
+            # REMOVED BY ANOTHER PROCESS
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def load_conll(path: str, sep=" ", cache_dir=None, max_size_mb=2048, evict=True):
+    """Parse a conll file into a Corpus, through the ParseCache when
+    cache_dir is set
+
+    Args:
+        path (str): filename (eg. dataset.conll)
+        sep (str, optional): column separator. Defaults to ' '.
+        cache_dir (str, optional): folder of the cache, None disables it.
+        max_size_mb (float, optional): size limit of the cache. Defaults to 2048.
+        evict (bool, optional): see {ParseCache.load}. Defaults to True.
+
+    Returns:
+        Corpus: the parsed corpus
+    """
+    if not cache_dir:
+        return Corpus.from_conll(path, sep)
+
+    return ParseCache(cache_dir, max_size_mb=max_size_mb).load(path, sep, evict=evict)
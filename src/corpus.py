@@ -0,0 +1,434 @@
+import os
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+
+
+class Corpus:
+    """Columnar (CSR-like) representation of a NER dataset
+
+    Instead of a DataFrame whose cells are Python lists, the whole dataset is
+    stored in three flat arrays, in the same layout as an Arrow list array:
+
+        tokens  : every token of every sentence, one after the other
+        tag_ids : integer id of the tag of each token (see `tag_names`)
+        offsets : sentence i is tokens[offsets[i]:offsets[i + 1]]
+
+    Slicing with a range of sentences (corpus[10:20]) does not copy any token,
+    and per-sentence operations can be written as NumPy expressions over
+    `offsets`/`lengths` instead of Python loops.
+
+    Args:
+        tokens (np.ndarray): flat array (dtype object) with all the tokens
+        tag_ids (np.ndarray): flat integer array with the tag id of each token
+        offsets (np.ndarray): array of len(sentences) + 1 sentence boundaries
+        tag_names (Sequence[str]): tag name of each tag id (eg. ['O', 'B-CPF'])
+        index (np.ndarray, optional): label of each sentence, kept when the
+            corpus is built from a DataFrame. Defaults to None (0..n-1).
+        source_file (np.ndarray, optional): shard filename of each sentence
+            (dtype object), kept by every selection, saved with the corpus and
+            written as the source_file col. Defaults to None.
+    """
+
+    def __init__(
+        self, tokens, tag_ids, offsets, tag_names, index=None, source_file=None
+    ):
+        self.tokens = tokens
+        self.tag_ids = tag_ids
+        self.offsets = offsets
+        self.tag_names = np.asarray(tag_names, dtype=object)
+        self.index = index
+        self.source_file = source_file
+
+        assert len(self.offsets) > 0 and self.offsets[0] == 0, "Invalid offsets"
+        assert self.offsets[-1] == len(self.tokens) == len(self.tag_ids), (
+            "tokens, tag_ids and offsets do not match"
+        )
+        assert source_file is None or len(source_file) == len(self), (
+            "source_file and offsets do not match"
+        )
+
+    # ---------------------- CONSTRUCTORS ----------------------
+
+    @classmethod
+    def from_conll(cls, path: str, sep=" ", batch_size=10000):
+        """Parse a conll file straight into the columnar layout
+
+        The file is streamed with `utils.iter_conll_sentences`, so only one
+        batch of sentences exists as Python lists at any time. Repeated tokens
+        share the same string object.
+
+        Args:
+            path (str): filename (eg. dataset.conll)
+            sep (str, optional): column separator. Defaults to ' '.
+            batch_size (int, optional): sentences read per chunk. Defaults to 10000.
+
+        Returns:
+            Corpus: the parsed corpus
+        """
+        vocabulary = {}
+        tag_index = {}
+        tokens, tag_ids, lengths = [], [], []
+
+        for batch in utils.iter_conll_sentences(path, sep, batch_size=batch_size):
+            words = [vocabulary.setdefault(w, w) for s, _ in batch for w in s]
+            tokens.append(_object_array(words))
+            tag_ids.append(
+                np.array(
+                    [
+                        tag_index.setdefault(t, len(tag_index))
+                        for _, tags in batch
+                        for t in tags
+                    ],
+                    dtype=np.int32,
+                )
+            )
+            lengths.append(np.array([len(s) for s, _ in batch], dtype=np.int64))
+
+        return cls(
+            tokens=np.concatenate(tokens) if tokens else _object_array([]),
+            tag_ids=np.concatenate(tag_ids) if tag_ids else np.zeros(0, np.int32),
+            offsets=_lengths2offsets(
+                np.concatenate(lengths) if lengths else np.zeros(0, np.int64)
+            ),
+            tag_names=list(tag_index),
+        )
+
+    @classmethod
+    def from_pandas(cls, df):
+        """Build a corpus from a DataFrame with text and tags cols
+
+        Args:
+            df (pd.DataFrame): DataFrame in the "sentence -> list<tag>" format,
+                with an optional source_file col
+
+        Returns:
+            Corpus: the corpus, keeping df.index as `index`
+        """
+        lengths = df["text"].map(len).to_numpy(dtype=np.int64)
+
+        tag_index = {}
+        tag_ids = np.array(
+            [
+                tag_index.setdefault(t, len(tag_index))
+                for t in chain.from_iterable(df["tags"])
+            ],
+            dtype=np.int32,
+        )
+
+        return cls(
+            tokens=_object_array(list(chain.from_iterable(df["text"]))),
+            tag_ids=tag_ids,
+            offsets=_lengths2offsets(lengths),
+            tag_names=list(tag_index),
+            index=df.index.to_numpy(),
+            source_file=(
+                _object_array(df["source_file"].tolist())
+                if "source_file" in df.columns
+                else None
+            ),
+        )
+
+    @classmethod
+    def concat(cls, corpora):
+        """Concatenate corpora, in order, into a single corpus
+
+        The tag vocabularies are merged, the `index` of the parts is dropped.
+        The `source_file` is kept when every part has one.
+
+        Args:
+            corpora (List[Corpus]): corpora to concatenate
+
+        Returns:
+            Corpus: the concatenated corpus
+        """
+        tag_index = {}
+        tag_ids = []
+        for corpus in corpora:
+            lookup = np.array(
+                [tag_index.setdefault(tag, len(tag_index)) for tag in corpus.tag_names],
+                dtype=np.int32,
+            )
+            tag_ids.append(lookup[corpus.tag_ids] if len(lookup) else corpus.tag_ids)
+
+        lengths = [corpus.lengths for corpus in corpora]
+        source_file = None
+        if corpora and all(c.source_file is not None for c in corpora):
+            source_file = np.concatenate([c.source_file for c in corpora])
+
+        return cls(
+            tokens=np.concatenate([c.tokens for c in corpora] + [_object_array([])]),
+            tag_ids=np.concatenate(tag_ids + [np.zeros(0, np.int32)]),
+            offsets=_lengths2offsets(np.concatenate(lengths + [np.zeros(0, np.int64)])),
+            tag_names=list(tag_index),
+            source_file=source_file,
+        )
+
+    @classmethod
+    def load(cls, path: str, mmap_mode=None, indices=None):
+        """Load a corpus written by `Corpus.save`
+
+        Args:
+            path (str): folder with the .npy files
+            mmap_mode (str, optional): passed to np.load, eg. 'r' to memory-map
+                the arrays instead of reading them. Defaults to None.
+            indices (array-like, optional): load only these sentences, in this
+                order. With mmap_mode='r' only their tokens are read and decoded.
+                Defaults to None (all the sentences).
+
+        Returns:
+            Corpus: the loaded corpus
+        """
+        def load_array(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+
+        vocabulary = _object_array(_decode_strings(load_array("vocabulary")))
+        token_ids, tag_ids, offsets = (
+            load_array("token_ids"),
+            load_array("tag_ids"),
+            load_array("offsets"),
+        )
+        index_path = os.path.join(path, "index.npy")
+        index = np.load(index_path) if os.path.exists(index_path) else None
+        source_file = None
+        if os.path.exists(os.path.join(path, "source_file_ids.npy")):
+            source_file = _object_array(
+                _decode_strings(load_array("source_files"))
+            )[load_array("source_file_ids")]
+
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int64)
+            lengths = np.diff(offsets)[indices]
+            selected = _lengths2offsets(lengths)
+            positions = _gather_positions(offsets[:-1][indices], lengths, selected)
+            token_ids, tag_ids = token_ids[positions], tag_ids[positions]
+            offsets = selected
+            index = indices if index is None else index[indices]
+            if source_file is not None:
+                source_file = source_file[indices]
+
+        return cls(
+            tokens=vocabulary[token_ids],
+            tag_ids=tag_ids,
+            offsets=offsets,
+            tag_names=_decode_strings(load_array("tag_names")),
+            index=index,
+            source_file=source_file,
+        )
+
+    def save(self, path: str):
+        """Save the corpus as a folder of .npy files (no pickle)
+
+        Tokens are stored as int32 ids into a vocabulary of distinct tokens.
+
+        Args:
+            path (str): folder to create
+        """
+        os.makedirs(path, exist_ok=True)
+
+        vocabulary = {}
+        token_ids = np.array(
+            [vocabulary.setdefault(t, len(vocabulary)) for t in self.tokens.tolist()],
+            dtype=np.int32,
+        )
+
+        np.save(os.path.join(path, "token_ids.npy"), token_ids)
+        np.save(os.path.join(path, "vocabulary.npy"), _encode_strings(vocabulary))
+        np.save(os.path.join(path, "tag_ids.npy"), np.asarray(self.tag_ids))
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(self.offsets))
+        np.save(os.path.join(path, "tag_names.npy"), _encode_strings(self.tag_names))
+        if self.index is not None:
+            np.save(os.path.join(path, "index.npy"), np.asarray(self.index))
+        if self.source_file is not None:
+            # ONE ID PER SENTENCE INTO THE DISTINCT FILENAMES
+            files = {}
+            file_ids = np.array(
+                [files.setdefault(f, len(files)) for f in self.source_file.tolist()],
+                dtype=np.int32,
+            )
+            np.save(os.path.join(path, "source_file_ids.npy"), file_ids)
+            np.save(os.path.join(path, "source_files.npy"), _encode_strings(files))
+
+    # ---------------------- ADAPTERS ----------------------
+
+    def to_pandas(self):
+        """Convert the corpus back to the "sentence -> list<tag>" DataFrame
+
+        Returns:
+            pd.DataFrame: DataFrame with text and tags cols (and source_file)
+        """
+        bounds = self.offsets.tolist()
+        tokens = self.tokens.tolist()
+        tags = self.tag_names[self.tag_ids].tolist()
+
+        df = pd.DataFrame()
+        df["text"] = [tokens[s:e] for s, e in zip(bounds[:-1], bounds[1:])]
+        df["tags"] = [tags[s:e] for s, e in zip(bounds[:-1], bounds[1:])]
+        if self.source_file is not None:
+            df["source_file"] = self.source_file
+        if self.index is not None:
+            df.index = self.index
+
+        return df
+
+    def token_view(self):
+        """Token level view of the corpus, one row per token
+
+        Same format as `utils.conll2pandas_group_by_token(only_last=True)`,
+        built from the flat arrays without reparsing.
+
+        Returns:
+            pd.DataFrame: DataFrame with text and tags cols
+        """
+        return pd.DataFrame({"text": self.tokens, "tags": self.tags})
+
+    def iter_sentences(self):
+        """Yield each sentence as a (tokens, tags) pair of lists"""
+        bounds = self.offsets.tolist()
+        for s, e in zip(bounds[:-1], bounds[1:]):
+            yield self.tokens[s:e].tolist(), self.tag_names[self.tag_ids[s:e]].tolist()
+
+    # ---------------------- SELECTION ----------------------
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        """corpus[i] returns the (tokens, tag_ids) views of sentence i,
+        corpus[i:j] returns a Corpus sharing the token and tag arrays."""
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            stop = max(start, stop)
+            first, last = self.offsets[start], self.offsets[stop]
+            return Corpus(
+                tokens=self.tokens[first:last],
+                tag_ids=self.tag_ids[first:last],
+                offsets=self.offsets[start : stop + 1] - first,
+                tag_names=self.tag_names,
+                index=None if self.index is None else self.index[start:stop],
+                source_file=(
+                    None if self.source_file is None else self.source_file[start:stop]
+                ),
+            )
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f"sentence {item} out of range")
+        s, e = self.offsets[item], self.offsets[item + 1]
+        return self.tokens[s:e], self.tag_ids[s:e]
+
+    def take(self, indices):
+        """Select (and copy) the sentences at the given positions, in order
+
+        Args:
+            indices (array-like): positions of the sentences to keep
+
+        Returns:
+            Corpus: a new corpus with the selected sentences
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[:-1][indices]
+        lengths = self.lengths[indices]
+        offsets = _lengths2offsets(lengths)
+        positions = _gather_positions(starts, lengths, offsets)
+
+        return Corpus(
+            tokens=self.tokens[positions],
+            tag_ids=self.tag_ids[positions],
+            offsets=offsets,
+            tag_names=self.tag_names,
+            index=None if self.index is None else self.index[indices],
+            source_file=None if self.source_file is None else self.source_file[indices],
+        )
+
+    def filter(self, mask):
+        """Keep only the sentences where the boolean `mask` is True"""
+        return self.take(np.flatnonzero(mask))
+
+    # ---------------------- VECTORIZED HELPERS ----------------------
+
+    @property
+    def lengths(self):
+        """Number of tokens of each sentence"""
+        return np.diff(self.offsets)
+
+    @property
+    def used_tag_names(self):
+        """The tag names of at least one token (`filter` keeps the vocabulary)"""
+        used = np.bincount(self.tag_ids, minlength=len(self.tag_names)) > 0
+        return self.tag_names[used]
+
+    @property
+    def sentence_ids(self):
+        """Sentence position of each token"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @property
+    def tags(self):
+        """Flat array with the tag name of each token"""
+        return self.tag_names[self.tag_ids]
+
+    def map_tags(self, func):
+        """Rewrite the tags with `func` (tag name -> new tag name)
+
+        `func` runs once per distinct tag, the token level rewrite is a single
+        lookup-table remap of `tag_ids`.
+
+        Returns:
+            Corpus: a new corpus sharing the tokens and offsets
+        """
+        tag_index = {}
+        lookup = np.array(
+            [tag_index.setdefault(func(tag), len(tag_index)) for tag in self.tag_names],
+            dtype=np.int32,
+        )
+
+        return Corpus(
+            tokens=self.tokens,
+            tag_ids=lookup[self.tag_ids] if len(lookup) else self.tag_ids,
+            offsets=self.offsets,
+            tag_names=list(tag_index),
+            index=self.index,
+            source_file=self.source_file,
+        )
+
+    def __repr__(self):
+        return (
+            f"Corpus(sentences={len(self)}, tokens={len(self.tokens)}, "
+            f"tags={len(self.tag_names)})"
+        )
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _encode_strings(strings):
+    """Pack strings (without line breaks) into one utf-8 uint8 array"""
+    text = "".join(string + "\n" for string in strings)
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(array):
+    return np.asarray(array).tobytes().decode("utf-8").split("\n")[:-1]
+
+
+def _lengths2offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _gather_positions(starts, lengths, offsets):
+    """Flat token positions of the sentences [starts, starts + lengths)"""
+    total = offsets[-1]
+    shift = np.repeat(starts - offsets[:-1], lengths)
+    return np.arange(total, dtype=np.int64) + shift
@@ -2,32 +2,66 @@ from typing import List
 
 import numpy as np
 
+from src.corpus import Corpus
+from src.entity_index import EntityBitmask
+
 
 def trucate_sentence_max_length(df, max_length=256):
     """Truncate sentences length
 
+    Vectorized over the sentence offsets, see {Corpus}.
+
     Args:
-        df (pd.DataFrame): The dataframe object
-        length_to_filter (int, optional): The sentence max length accepted.
+        df (pd.DataFrame | Corpus): The dataframe object
+        max_length (int, optional): The sentence max length accepted.
         Defaults to 256.
 
     Returns:
-        pd.DataFrame: The dataframe object filtered
+        pd.DataFrame | Corpus: The dataframe object filtered
     """
     assert max_length > 0, "Length must be positive"
 
-    def truncate_sentences(row, max_length=256):
-        if len(row["text"]) > max_length:
-            row["text"] = row["text"][:max_length]
-            row["tags"] = row["tags"][:max_length]
+    if isinstance(df, Corpus):
+        return _truncate_corpus(df, max_length)
+
+    truncated = _truncate_corpus(Corpus.from_pandas(df), max_length).to_pandas()
+    df["text"] = truncated["text"].to_numpy()
+    df["tags"] = truncated["tags"].to_numpy()
+    return df
 
-        return row
 
-    df[["text", "tags"]] = df[["text", "tags"]].apply(
-        lambda row: truncate_sentences(row, max_length=256),
-        axis=1,
-        result_type="expand",
-    )
+def window_long_sentences(df, max_length=256, stride=128):
+    """Split the sentences longer than max_length into overlapping windows
+
+    Instead of dropping the tokens after max_length, a long sentence becomes
+    windows of up to max_length tokens starting every `stride` tokens. The
+    window boundaries are moved back to the start of an entity, so no BIO
+    entity is cut in half (only an entity longer than max_length is).
+
+    Args:
+        df (pd.DataFrame | Corpus): The dataframe object
+        max_length (int, optional): Max length of a window. Defaults to 256.
+        stride (int, optional): Tokens between the start of two windows of the
+            same sentence, at most max_length. Defaults to 128.
+
+    Returns:
+        pd.DataFrame | Corpus: one row per window, the windows of a sentence
+        keep its index (like DataFrame.explode)
+    """
+    assert max_length > 0, "Length must be positive"
+    assert 0 < stride <= max_length, "Stride must be between 1 and max_length"
+
+    if isinstance(df, Corpus):
+        return _window_corpus(df, max_length, stride)
+
+    corpus = Corpus.from_pandas(df)
+    corpus.index = np.arange(len(df))
+    windows = _window_corpus(corpus, max_length, stride)
+
+    df = df.iloc[windows.index].copy()
+    windows = windows.to_pandas()
+    df["text"] = windows["text"].to_numpy()
+    df["tags"] = windows["tags"].to_numpy()
     return df
 
 
@@ -36,14 +70,17 @@ def fill_O_tags(df, tags_to_remove: List):
     All tags to be removed are replaced to 'O'
 
     Args:
-        df (pd.DataFrame): The dataframe object
+        df (pd.DataFrame | Corpus): The dataframe object
         tags_to_remove (List): List of entities (tags) to be removed
 
     Returns:
-        pd.Dataframe: The dataframe object without the list of tags
+        pd.Dataframe | Corpus: The dataframe object without the list of tags
     """
     print("Fill O tags", tags_to_remove)
 
+    if isinstance(df, Corpus):
+        return df.map_tags(lambda tag: "O" if tag[2:] in tags_to_remove else tag)
+
     df["tags"] = df["tags"].apply(
         lambda tags: ["O" if tag[2:] in tags_to_remove else tag for tag in tags]
     )
@@ -96,16 +133,12 @@ def undersampling_negative_sentences(df, ratio_to_remove=0.8):
     """
 
     # sentences with ALL TAGS '0'
-    df["nullSentences"] = df["tags"].apply(
-        lambda tags: all([tag == "O" for tag in tags])
-    )
+    null_sentences = EntityBitmask.from_pandas(df).negative
 
-    df2 = df[df["nullSentences"]].sample(frac=ratio_to_remove, random_state=0)
+    df2 = df[null_sentences].sample(frac=ratio_to_remove, random_state=0)
 
     # todos os index que não estão nos retirados
     dataset_filtered = df[~df.index.isin(df2.index)]
-    # remover a coluna criada e resetar os indexes
-    dataset_filtered = dataset_filtered.drop("nullSentences", axis=1)
 
     return dataset_filtered.reset_index()
 
@@ -123,30 +156,33 @@ def undersampling_entity(df, undersampling_tags, ratio_to_remove=0.5):
     """
 
     # sentences with at least one TAG
-    df["withEntity"] = df["tags"].apply(
-        lambda tags: any([tag[2:] in undersampling_tags for tag in tags])
-    )
+    with_entity = EntityBitmask.from_pandas(df).any(list(undersampling_tags))
 
-    df2 = df[df["withEntity"]].sample(frac=ratio_to_remove, random_state=0)
+    df2 = df[with_entity].sample(frac=ratio_to_remove, random_state=0)
 
     # todos os index que não estão nos retirados
     dataset_filtered = df[~df.index.isin(df2.index)]
-    # remover a coluna criada e resetar os indexes
-    dataset_filtered = dataset_filtered.drop("withEntity", axis=1)
 
     return dataset_filtered.reset_index(drop=True)
 
 
 def remove_jurisprudencia_sentence(df):
     # REMOVE JURISPRUDENCIA
-    df["haveJurisprudencia"] = df["tags"].apply(lambda x: "B-Jurisprudência" in x)
-    print("SENTENÇAS COM JURISPRUDENCIA ", df["haveJurisprudencia"].sum())
-    df = df[df["haveJurisprudencia"] is False][["text", "tags"]].reset_index()
+    have_jurisprudencia = EntityBitmask.from_pandas(df).any("B-Jurisprudência")
+    print("SENTENÇAS COM JURISPRUDENCIA ", have_jurisprudencia.sum())
+    # keep the other cols (e.g. source_file)
+    df = df[~have_jurisprudencia]
+    df = df.reset_index(drop=True)
     return df
 
 
 def datas_change(df, datas_to_change=["Data_do_contrato", "Data_dos_fatos"]):
     # AGGREGATE datas to change with generic Datas
+    if isinstance(df, Corpus):
+        return df.map_tags(
+            lambda tag: tag[:2] + "Datas" if tag[2:] in datas_to_change else tag
+        )
+
     df["tags"] = df["tags"].apply(
         lambda x: [
             tag[:2] + "Datas" if tag[2:] in datas_to_change else tag for tag in x
@@ -154,3 +190,360 @@ def datas_change(df, datas_to_change=["Data_do_contrato", "Data_dos_fatos"]):
     )
 
     return df.reset_index()
+
+
+class PreprocessingPipeline:
+    """All the PREPROCESSING steps of main.py compiled into one pass over a Corpus
+
+    Same result as running, in this order, fill_O_tags, datas_change,
+    remove_jurisprudencia_sentence, trucate_sentence_max_length (or
+    window_long_sentences), undersampling_negative_sentences and
+    undersampling_entity, but:
+
+        - every tag rewrite (fill O, datas aggregation, merge_tags) is composed
+          into one lookup table, applied once to the integer tag ids
+        - every sentence filter is a mask over one EntityBitmask, no helper
+          cols or reset_index
+        - the undersampling draws the same sentences as DataFrame.sample
+          (np.random.RandomState(0).choice without replacement)
+
+        pipeline = PreprocessingPipeline.from_config(config["PREPROCESSING"])
+        corpus = pipeline.run(corpus)
+
+    Args:
+        fill_O_tags (List[str], optional): entity types replaced by 'O'
+        datas_aggregation (List[str], optional): entity types replaced by Datas
+        merge_tags (Dict[str, str], optional): other entity type -> entity type
+            replacements, applied after the datas aggregation
+        remove_jurisprudencia_sentence (bool, optional): remove the sentences
+            with B-Jurisprudência. Defaults to False.
+        max_length_sentence (int, optional): truncation length. Defaults to 256.
+        long_sentence_mode (str, optional): 'truncate' the longer sentences or
+            split them in 'window's. Defaults to 'truncate'.
+        window_stride (int, optional): stride of the windows, see
+            {window_long_sentences}. Defaults to None (max_length_sentence // 2).
+        undersampling_negative_sentences (bool, optional): undersample the
+            sentences with only 'O' tags. Defaults to False.
+        ratio_of_undersample_negative_sentences (float, optional): Defaults to 0.8.
+        undersampling_tags (List[str], optional): undersample the sentences with
+            any of these tags or entity types
+        ratio_of_undersample_tags (float, optional): Defaults to 0.5.
+    """
+
+    def __init__(
+        self,
+        fill_O_tags=(),
+        datas_aggregation=(),
+        merge_tags=None,
+        remove_jurisprudencia_sentence=False,
+        max_length_sentence=256,
+        long_sentence_mode="truncate",
+        window_stride=None,
+        undersampling_negative_sentences=False,
+        ratio_of_undersample_negative_sentences=0.8,
+        undersampling_tags=(),
+        ratio_of_undersample_tags=0.5,
+    ):
+        assert max_length_sentence > 0, "Length must be positive"
+        assert long_sentence_mode in (
+            "truncate",
+            "window",
+        ), f"Unknown long_sentence_mode {long_sentence_mode}"
+        self.fill_O_tags = list(fill_O_tags or [])
+        self.datas_aggregation = list(datas_aggregation or [])
+        self.merge_tags = dict(merge_tags or {})
+        self.remove_jurisprudencia_sentence = remove_jurisprudencia_sentence
+        self.max_length_sentence = max_length_sentence
+        self.long_sentence_mode = long_sentence_mode
+        self.window_stride = window_stride or max(max_length_sentence // 2, 1)
+        self.undersampling_negative_sentences = undersampling_negative_sentences
+        self.ratio_of_undersample_negative_sentences = (
+            ratio_of_undersample_negative_sentences
+        )
+        self.undersampling_tags = list(undersampling_tags or [])
+        self.ratio_of_undersample_tags = ratio_of_undersample_tags
+
+    @classmethod
+    def from_config(cls, config):
+        """Pipeline of the PREPROCESSING section of settings.yaml"""
+        return cls(
+            fill_O_tags=config.get("fill_O_tags", ""),
+            datas_aggregation=config.get("datas_aggregation"),
+            merge_tags=config.get("merge_tags"),
+            remove_jurisprudencia_sentence=config.get(
+                "remove_jurisprudencia_sentence", False
+            ),
+            max_length_sentence=config.get("max_length_sentence", 256),
+            long_sentence_mode=config.get("long_sentence_mode", "truncate"),
+            window_stride=config.get("window_stride"),
+            undersampling_negative_sentences=config.get(
+                "undersampling_negative_sentences"
+            ),
+            ratio_of_undersample_negative_sentences=config.get(
+                "ratio_of_undersample_negative_sentences", 0.8
+            ),
+            undersampling_tags=config.get("undersampling_tags"),
+            ratio_of_undersample_tags=config.get("ratio_of_undersample_tags", 0.5),
+        )
+
+    def rename_tag(self, tag):
+        """New name of a tag after fill O, datas aggregation and merge_tags"""
+        entity_type = tag[2:]
+        if entity_type in self.fill_O_tags:
+            return "O"
+        if entity_type in self.datas_aggregation:
+            entity_type = "Datas"
+        entity_type = self.merge_tags.get(entity_type, entity_type)
+
+        return tag if entity_type == tag[2:] else tag[:2] + entity_type
+
+    def stages(self):
+        """(name, config slice, function) of each stage, in the order they run
+
+        The config slice holds every setting the stage output depends on, see
+        {StepCache}.
+        """
+        max_length = {
+            "max_length_sentence": self.max_length_sentence,
+            "long_sentence_mode": self.long_sentence_mode,
+        }
+        if self.long_sentence_mode == "window":
+            # THE STRIDE IS IGNORED WHEN TRUNCATING
+            max_length["window_stride"] = self.window_stride
+
+        return [
+            (
+                "tags",
+                {
+                    "fill_O_tags": self.fill_O_tags,
+                    "datas_aggregation": self.datas_aggregation,
+                    "merge_tags": self.merge_tags,
+                },
+                self._rename_tags,
+            ),
+            (
+                "jurisprudencia",
+                {
+                    "remove_jurisprudencia_sentence": bool(
+                        self.remove_jurisprudencia_sentence
+                    )
+                },
+                self._remove_jurisprudencia,
+            ),
+            (
+                "max_length",
+                max_length,
+                self._limit_length,
+            ),
+            (
+                "undersampling",
+                {
+                    "undersampling_negative_sentences": bool(
+                        self.undersampling_negative_sentences
+                    ),
+                    "ratio_of_undersample_negative_sentences": (
+                        self.ratio_of_undersample_negative_sentences
+                    ),
+                    "undersampling_tags": self.undersampling_tags,
+                    "ratio_of_undersample_tags": self.ratio_of_undersample_tags,
+                },
+                self._undersampling,
+            ),
+        ]
+
+    def run(self, corpus, cache=None, input_key=None):
+        """Preprocess the corpus
+
+        With a StepCache, the output of each stage is cached and the run resumes
+        from the output of the last stage whose input and config did not change.
+        A stage that returns its input unchanged is not stored again.
+
+        Args:
+            corpus (Corpus | pd.DataFrame): the dataset
+            cache (StepCache, optional): cache of the stage outputs. Defaults to None.
+            input_key (str, optional): key of `corpus`, eg. StepCache.source_key of
+                its conll files. Defaults to None (StepCache.input_key(corpus)).
+
+        Returns:
+            Corpus: the kept sentences, its index holds their index in the input
+        """
+        if not isinstance(corpus, Corpus):
+            corpus = Corpus.from_pandas(corpus)
+        stages = self.stages()
+
+        if cache is None:
+            for _, _, stage in stages:
+                corpus = stage(corpus)
+            return corpus
+
+        keys = [input_key or cache.input_key(corpus)]
+        for name, config, _ in stages:
+            keys.append(cache.key(keys[-1], name, config))
+
+        # RESUME FROM THE LAST CACHED STAGE
+        first = 0
+        for i in reversed(range(len(stages))):
+            cached = cache.get(keys[i + 1])
+            if cached is not None:
+                print(f"Preprocessing stage {stages[i][0]} loaded from cache")
+                corpus, first = cached, i + 1
+                break
+
+        for i in range(first, len(stages)):
+            output = stages[i][2](corpus)
+            if output is not corpus:
+                cache.put(keys[i + 1], output)
+            corpus = output
+
+        return corpus
+
+    def _rename_tags(self, corpus):
+        # ONE REMAP FOR ALL THE TAG REWRITES
+        corpus = corpus.map_tags(self.rename_tag)
+        if corpus.index is None:
+            corpus.index = np.arange(len(corpus))
+        return corpus
+
+    def _remove_jurisprudencia(self, corpus):
+        if not self.remove_jurisprudencia_sentence:
+            return corpus
+
+        jurisprudencia = EntityBitmask(corpus).any("B-Jurisprudência")
+        print("SENTENÇAS COM JURISPRUDENCIA ", jurisprudencia.sum())
+        return corpus.filter(~jurisprudencia)
+
+    def _limit_length(self, corpus):
+        # MAX_LENGTH: TRUNCATE OR SPLIT IN WINDOWS
+        if self.long_sentence_mode == "window":
+            return _window_corpus(corpus, self.max_length_sentence, self.window_stride)
+        return _truncate_corpus(corpus, self.max_length_sentence)
+
+    def _undersampling(self, corpus):
+        # ONE BITMASK FOR THE SENTENCE FILTERS
+        bitmask = EntityBitmask(corpus)
+        keep = np.ones(len(corpus), dtype=bool)
+        if self.undersampling_negative_sentences:
+            self._undersample(
+                keep, bitmask.negative, self.ratio_of_undersample_negative_sentences
+            )
+        if self.undersampling_tags:
+            self._undersample(
+                keep, bitmask.any(self.undersampling_tags), self.ratio_of_undersample_tags
+            )
+
+        if keep.all():
+            return corpus
+        return corpus.filter(keep)
+
+    @staticmethod
+    def _undersample(keep, candidates, ratio):
+        """Drop (in place, from keep) the sentences DataFrame.sample(frac=ratio,
+        random_state=0) would draw from the kept candidates"""
+        candidates = np.flatnonzero(keep & candidates)
+        size = round(ratio * len(candidates))
+        drawn = np.random.RandomState(0).choice(len(candidates), size, replace=False)
+        keep[candidates[drawn]] = False
+
+
+def _truncate_corpus(corpus, max_length):
+    """Keep only the first max_length tokens of each sentence of a Corpus"""
+    lengths = corpus.lengths
+    if not len(lengths) or lengths.max() <= max_length:
+        return corpus
+
+    positions = np.arange(len(corpus.tokens)) - np.repeat(corpus.offsets[:-1], lengths)
+    tokens = positions < max_length
+    offsets = np.zeros(len(corpus) + 1, dtype=np.int64)
+    np.cumsum(np.minimum(lengths, max_length), out=offsets[1:])
+
+    return Corpus(
+        tokens=corpus.tokens[tokens],
+        tag_ids=corpus.tag_ids[tokens],
+        offsets=offsets,
+        tag_names=corpus.tag_names,
+        index=corpus.index,
+        source_file=corpus.source_file,
+    )
+
+
+def _window_corpus(corpus, max_length, stride):
+    """Split the sentences of a Corpus longer than max_length into windows"""
+    lengths = corpus.lengths
+    long = np.flatnonzero(lengths > max_length)
+    if not len(long):
+        return corpus
+
+    # A WINDOW CAN START (AND THE PREVIOUS END) AT ANY TOKEN BUT AN I- TOKEN
+    inside = np.array([tag.startswith("I-") for tag in corpus.tag_names], dtype=bool)
+
+    # THE SHORT SENTENCES ARE A WINDOW, THE LONG ONES ARE REPLACED BY THEIR WINDOWS
+    replaced = np.zeros(len(corpus), dtype=bool)
+    replaced[long] = True
+    sentences, starts, window_lengths, is_window = (
+        [np.arange(len(corpus))],
+        [corpus.offsets[:-1]],
+        [lengths],
+        [~replaced],
+    )
+    for sentence in long.tolist():
+        first, length = int(corpus.offsets[sentence]), int(lengths[sentence])
+        cuts = np.flatnonzero(~inside[corpus.tag_ids[first : first + length]])
+        cuts = np.union1d(cuts, [0, length])
+
+        bounds = _window_bounds(cuts, length, max_length, stride)
+        sentences.append(np.full(len(bounds), sentence))
+        starts.append(first + bounds[:, 0])
+        window_lengths.append(bounds[:, 1] - bounds[:, 0])
+        is_window.append(np.ones(len(bounds), dtype=bool))
+
+    sentences, starts, window_lengths, is_window = (
+        np.concatenate(sentences),
+        np.concatenate(starts),
+        np.concatenate(window_lengths),
+        np.concatenate(is_window),
+    )
+    # WINDOWS IN THE ORDER OF THEIR SENTENCES
+    order = np.argsort(sentences, kind="stable")
+    order = order[is_window[order]]
+    sentences, starts, window_lengths = (
+        sentences[order],
+        starts[order],
+        window_lengths[order],
+    )
+
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(window_lengths, out=offsets[1:])
+    positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], window_lengths)
+
+    return Corpus(
+        tokens=corpus.tokens[positions],
+        tag_ids=corpus.tag_ids[positions],
+        offsets=offsets,
+        tag_names=corpus.tag_names,
+        index=sentences if corpus.index is None else np.asarray(corpus.index)[sentences],
+        source_file=None if corpus.source_file is None else corpus.source_file[sentences],
+    )
+
+
+def _window_bounds(cuts, length, max_length, stride):
+    """(start, end) of the windows of one sentence, given its sorted cut points"""
+    bounds = []
+    start = 0
+    while True:
+        if start + max_length >= length:
+            bounds.append((start, length))
+            break
+
+        # THE LAST CUT THAT FITS, AN ENTITY LONGER THAN max_length IS CUT
+        end = int(cuts[np.searchsorted(cuts, start + max_length, side="right") - 1])
+        if end <= start:
+            end = start + max_length
+        bounds.append((start, end))
+
+        # THE NEXT START: stride LATER, MOVED BACK TO A CUT, NO GAP AFTER end
+        following = int(cuts[np.searchsorted(cuts, start + stride, side="right") - 1])
+        if following <= start:
+            following = int(cuts[np.searchsorted(cuts, start, side="right")])
+        start = min(following, end)
+
+    return np.array(bounds, dtype=np.int64)
@@ -0,0 +1,270 @@
+import numpy as np
+
+from src.corpus import Corpus
+
+
+class EntityIndex:
+    """Inverted index from tags and entity types to the sentences that have them
+
+    Built once per corpus with a single sort of the (label, sentence) pairs,
+    each query then costs O(hits) instead of a scan of every sentence.
+
+    Two kinds of labels can be queried:
+        tags         : 'B-Jurisprudência', 'I-CPF', 'O', ...
+        entity types : 'Jurisprudência', 'CPF', ... (tag[2:] of every tag but 'O')
+
+        index = EntityIndex(corpus)
+        index.sentences("B-Jurisprudência")  # sorted sentence positions
+        index.counts("Normativo")            # tokens of the type in each of them
+
+    Args:
+        corpus (Corpus): the corpus to index
+    """
+
+    def __init__(self, corpus):
+        self.n_sentences = len(corpus)
+        sentence_ids = corpus.sentence_ids
+
+        # TAG INDEX
+        self._tags = self._build(corpus.tag_ids, sentence_ids, list(corpus.tag_names))
+
+        # ENTITY TYPE INDEX, 'O' IS NOT AN ENTITY
+        types = {}
+        type_of_tag = np.array(
+            [
+                -1 if tag == "O" else types.setdefault(tag[2:], len(types))
+                for tag in corpus.tag_names
+            ],
+            dtype=np.int64,
+        )
+        token_types = type_of_tag[corpus.tag_ids] if len(type_of_tag) else corpus.tag_ids
+        is_entity = token_types >= 0
+        self._types = self._build(
+            token_types[is_entity], sentence_ids[is_entity], list(types)
+        )
+
+    @classmethod
+    def from_pandas(cls, df):
+        """Index a DataFrame with text and tags cols (positions, not labels)"""
+        return cls(Corpus.from_pandas(df))
+
+    @property
+    def tags(self):
+        """Tags present in the corpus"""
+        return list(self._tags[0])
+
+    @property
+    def entity_types(self):
+        """Entity types present in the corpus"""
+        return list(self._types[0])
+
+    def sentences(self, label):
+        """Sorted positions of the sentences with the tag or entity type `label`"""
+        return self._lookup(label)[0]
+
+    def counts(self, label):
+        """Tokens with the tag/entity type `label` in each of `sentences(label)`"""
+        return self._lookup(label)[1]
+
+    def mask(self, labels):
+        """Boolean array, True for the sentences with any of the `labels`"""
+        if isinstance(labels, str):
+            labels = [labels]
+
+        mask = np.zeros(self.n_sentences, dtype=bool)
+        for label in labels:
+            mask[self.sentences(label)] = True
+
+        return mask
+
+    def __contains__(self, label):
+        return label in self._tags[0] or label in self._types[0]
+
+    def _lookup(self, label):
+        for bounds, sentences, counts in (self._tags, self._types):
+            if label in bounds:
+                start, end = bounds[label]
+                return sentences[start:end], counts[start:end]
+
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    def _build(self, label_ids, sentence_ids, names):
+        """(label -> slice, sentences, counts) with the pairs sorted by label
+        and sentence"""
+        keys = label_ids.astype(np.int64) * max(self.n_sentences, 1) + sentence_ids
+        keys, counts = np.unique(keys, return_counts=True)
+        labels, sentences = np.divmod(keys, max(self.n_sentences, 1))
+
+        bounds = np.searchsorted(labels, np.arange(len(names) + 1))
+        slices = {
+            name: (bounds[i], bounds[i + 1])
+            for i, name in enumerate(names)
+            if bounds[i] < bounds[i + 1]
+        }
+
+        return slices, sentences, counts
+
+
+class EntityBitmask:
+    """Per-sentence bitmask of the tags present in each sentence
+
+    Built in a single pass over the tokens: bit j of sentence i is set when the
+    sentence has a token with tag_names[j]. With more than 64 tags the bitmask
+    takes more than one uint64 word per sentence. Every sentence filter then is
+    a vectorized AND over `bits`, with no Python predicate per sentence:
+
+        bitmask = EntityBitmask(corpus)
+        bitmask.negative                     # only 'O' tags
+        bitmask.any(["Normativo", "B-CPF"])  # any of the tags / entity types
+
+    Labels are tags ('B-Jurisprudência', 'O', ...) or entity types
+    ('Jurisprudência' matches B-Jurisprudência and I-Jurisprudência).
+
+    Args:
+        corpus (Corpus): the corpus to index
+    """
+
+    def __init__(self, corpus):
+        self.n_sentences = len(corpus)
+        self.tag_names = list(corpus.tag_names)
+        n_words = max((len(self.tag_names) + 63) // 64, 1)
+        self.bits = np.zeros((self.n_sentences, n_words), dtype=np.uint64)
+
+        # DISTINCT (SENTENCE, TAG) PAIRS, THE BITS OF A SENTENCE ARE OR-ED PER WORD
+        keys = np.unique(
+            corpus.sentence_ids * len(self.tag_names) + np.asarray(corpus.tag_ids)
+        )
+        sentences, tags = np.divmod(keys, max(len(self.tag_names), 1))
+        words, bits = np.divmod(tags, 64)
+        values = np.left_shift(np.uint64(1), bits.astype(np.uint64))
+        for word in np.unique(words).tolist():
+            in_word = words == word
+            np.bitwise_or.at(self.bits[:, word], sentences[in_word], values[in_word])
+
+    @classmethod
+    def from_pandas(cls, df):
+        """Bitmask of a DataFrame with text and tags cols (positions, not labels)"""
+        return cls(Corpus.from_pandas(df))
+
+    def query(self, labels):
+        """Bitmask (one row of words) of the tags matching any of the labels"""
+        if isinstance(labels, str):
+            labels = [labels]
+        labels = set(labels)
+
+        query = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        for j, tag in enumerate(self.tag_names):
+            if tag in labels or (tag != "O" and tag[2:] in labels):
+                query[j // 64] |= np.uint64(1) << np.uint64(j % 64)
+
+        return query
+
+    def any(self, labels):
+        """Boolean array, True for the sentences with any of the `labels`"""
+        return (self.bits & self.query(labels)).any(axis=1)
+
+    @property
+    def negative(self):
+        """Boolean array, True for the sentences with only 'O' tags (or empty)"""
+        entities = [tag for tag in self.tag_names if tag != "O"]
+        return ~(self.bits & self.query(entities)).any(axis=1)
+
+
+class EntitySpans:
+    """BIO decoder: the entity spans of a corpus, in one vectorized pass
+
+    A span starts at a B- tag, or at an I- tag that does not continue a span of
+    the same type (the token before it has another tag or it starts the
+    sentence). The latter is a malformed BIO sequence, decoded as a span like
+    conlleval does and flagged in `malformed`. The spans are the arrays:
+
+        starts    : token position (in corpus.tokens) of the first token
+        lengths   : number of tokens
+        types     : entity type id (see `type_names`)
+        sentences : sentence position
+        malformed : True for the spans that start with I-
+
+        spans = EntitySpans(corpus)
+        spans.length_histograms()  # spans of each type with each length
+        spans.cooccurrence()       # sentences with both types
+
+    Args:
+        corpus (Corpus): the corpus to decode
+    """
+
+    def __init__(self, corpus):
+        self.n_sentences = len(corpus)
+        offsets = np.asarray(corpus.offsets)
+        tag_ids = np.asarray(corpus.tag_ids, dtype=np.int64)
+
+        types = {}
+        type_of_tag = np.array(
+            [
+                -1 if tag == "O" else types.setdefault(tag[2:], len(types))
+                for tag in corpus.tag_names
+            ],
+            dtype=np.int64,
+        )
+        inside_tag = np.array([tag[:2] == "I-" for tag in corpus.tag_names], dtype=bool)
+        self.type_names = list(types)
+
+        token_types = type_of_tag[tag_ids] if len(tag_ids) else tag_ids
+        inside = inside_tag[tag_ids] if len(tag_ids) else np.zeros(0, dtype=bool)
+
+        # TYPE OF THE PREVIOUS TOKEN OF THE SENTENCE, -1 AT THE FIRST TOKEN
+        previous = np.empty_like(token_types)
+        previous[1:] = token_types[:-1]
+        sentence_starts = offsets[:-1][np.diff(offsets) > 0]
+        previous[sentence_starts] = -1
+
+        is_entity = token_types >= 0
+        is_start = is_entity & ~(inside & (previous == token_types))
+        self.starts = np.flatnonzero(is_start)
+
+        # EVERY ENTITY TOKEN BELONGS TO THE SPAN OF THE LAST START
+        span_of_token = np.cumsum(is_start)[is_entity] - 1
+        self.lengths = np.bincount(span_of_token, minlength=len(self.starts))
+        self.types = token_types[self.starts]
+        self.sentences = np.searchsorted(offsets, self.starts, side="right") - 1
+        self.malformed = inside[self.starts]
+
+    @classmethod
+    def from_pandas(cls, df):
+        """Decode a DataFrame with text and tags cols (positions, not labels)"""
+        return cls(Corpus.from_pandas(df))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def length_histograms(self):
+        """Array (types x max length + 1), spans of each type with each length"""
+        size = int(self.lengths.max()) + 1 if len(self) else 1
+        histograms = np.bincount(
+            self.types * size + self.lengths, minlength=len(self.type_names) * size
+        )
+
+        return histograms.reshape(len(self.type_names), size)
+
+    def cooccurrence(self, chunk_size=65536):
+        """Array (types x types), sentences with both types (diagonal: with the
+        type), an incidence matrix product over chunks of sentences"""
+        n_types = len(self.type_names)
+        keys = np.unique(self.sentences * max(n_types, 1) + self.types)
+        sentences, types = np.divmod(keys, max(n_types, 1))
+        # ONLY THE SENTENCES WITH ENTITIES, RENUMBERED 0..n-1
+        _, rows = np.unique(sentences, return_inverse=True)
+
+        n_rows = rows.max() + 1 if len(rows) else 0
+        bounds = np.append(
+            np.searchsorted(rows, np.arange(0, n_rows, chunk_size)), len(rows)
+        )
+
+        matrix = np.zeros((n_types, n_types), dtype=np.int64)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            incidence = np.zeros((rows[end - 1] - rows[start] + 1, n_types))
+            incidence[rows[start:end] - rows[start], types[start:end]] = 1
+            # FLOAT64 IS EXACT FOR COUNTS < 2^53 AND USES BLAS
+            matrix += np.rint(incidence.T @ incidence).astype(np.int64)
+
+        return matrix
@@ -0,0 +1,393 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src import utils
+from src.balanceamento import balance_from_dataframe, balance_global
+from src.corpus import Corpus
+from src.stats import LENGTH_THRESHOLDS, DatasetAnalysis, StatsAccumulator
+from src.stratify import IterativeStratifiedKFold, entity_count_matrix, split_groups
+
+# folder, inside SAVE.save_folder, of the corpus shared by all the folds
+CORPUS_FOLDER = "corpus"
+
+
+def split_folds(df, groups=None, n_splits=5, strategy="kfold", random_state=0):
+    """Train and dev positions of each fold, keeping each group in one fold
+
+    The groups are the original sentences (Corpus.index after preprocessing):
+    with long_sentence_mode=window the windows of a sentence overlap, so they
+    must all go to train or all to dev. With one row per sentence the folds
+    are the ones of splitting the rows.
+
+    Args:
+        df (pd.DataFrame): the preprocessed dataset
+        groups (array-like, optional): group of each row. Defaults to None
+            (each row is its own group).
+        n_splits (int, optional): number of folds. Defaults to 5.
+        strategy (str, optional): 'kfold' (random) or 'stratified' (iterative
+            stratification of the entity counts). Defaults to 'kfold'.
+        random_state (int, optional): seed. Defaults to 0.
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: train and dev positions of each fold
+    """
+    if groups is None:
+        groups = np.arange(len(df))
+
+    if strategy == "stratified":
+        # ITERATIVE STRATIFICATION OVER THE ENTITY COUNTS OF EACH SENTENCE
+        entity_counts, _ = entity_count_matrix(df)
+        kf = IterativeStratifiedKFold(n_splits=n_splits, random_state=random_state)
+        return list(kf.split(df, entity_counts, groups=groups))
+
+    # KFOLD - sklearn IMPORTED ONLY HERE, IT IS SLOW TO IMPORT
+    from sklearn.model_selection import KFold
+
+    kf = KFold(n_splits=n_splits, random_state=random_state, shuffle=True)
+    return list(split_groups(kf, groups))
+
+
+def save_corpus(df, save_folder: str):
+    """Save the preprocessed corpus once, for the index-only folds
+
+    Args:
+        df (pd.DataFrame | Corpus): the preprocessed dataset
+        save_folder (str): SAVE.save_folder
+    """
+    corpus = df if isinstance(df, Corpus) else Corpus.from_pandas(df)
+    corpus.save(os.path.join(save_folder, CORPUS_FOLDER))
+
+
+def save_fold_indexes(train_data, test_data, save_path: str):
+    """Save only the sentence ids (DataFrame index) of the train and dev splits
+
+    The ids are positions in the corpus written by {save_corpus}, kept in the
+    order of the splits (train.idx.npy, dev.idx.npy).
+    """
+    for data, name in ((train_data, "train"), (test_data, "dev")):
+        np.save(
+            os.path.join(save_path, name + ".idx.npy"),
+            data.index.to_numpy(dtype=np.int64),
+        )
+
+
+def load_fold(save_folder: str, fold=0, split="train", mmap_mode="r"):
+    """Reconstruct one split of an index-only fold from the shared corpus
+
+    The corpus arrays are memory-mapped and only the sentences of the split
+    are read and decoded.
+
+        train = load_fold("data/processed/v11", fold=0, split="train")
+        df = train.to_pandas()
+
+    Args:
+        save_folder (str): SAVE.save_folder of the run
+        fold (int, optional): fold number. Defaults to 0.
+        split (str, optional): 'train' or 'dev'. Defaults to 'train'.
+        mmap_mode (str, optional): see {Corpus.load}. Defaults to 'r'.
+
+    Returns:
+        Corpus: the split, its index holds the sentence ids in the corpus
+    """
+    assert split in ("train", "dev"), "split must be 'train' or 'dev'"
+    indices = np.load(os.path.join(save_folder, f"fold-{fold}", f"{split}.idx.npy"))
+
+    return Corpus.load(
+        os.path.join(save_folder, CORPUS_FOLDER), mmap_mode=mmap_mode, indices=indices
+    )
+
+
+def check_save_config(save_config):
+    """Assert that SAVE.index_only is not combined with options it ignores
+
+    An index-only fold has no conll, json or parquet files, so the parquet
+    output and the compression of the fold files cannot be applied.
+    """
+    if save_config.get("index_only", False):
+        assert not save_config.get(
+            "save_into_parquet", False
+        ), "SAVE.index_only writes no parquet files, unset save_into_parquet"
+        assert (
+            save_config.get("compression") is None
+        ), "SAVE.index_only writes no fold files to compress, unset compression"
+
+
+def save_fold(train_data, test_data, save_path, save_config, tag_names=None):
+    """Save the train and dev splits of a fold in every format enabled in SAVE
+
+    Args:
+        train_data (pd.DataFrame): train split
+        test_data (pd.DataFrame): dev split
+        save_path (str): folder of the fold
+        save_config (DictConfig): SAVE section of settings.yaml
+        tag_names (List[str], optional): vocabulary of the parquet tag ids
+    """
+    check_save_config(save_config)
+    if save_config.get("index_only", False):
+        # ONLY THE SENTENCE IDS, THE CORPUS IS SAVED ONCE - see load_fold
+        save_fold_indexes(train_data, test_data, save_path)
+        return
+
+    extension = utils.COMPRESSION_EXTENSIONS.get(save_config.get("compression"), "")
+    splits = ((train_data, save_path + "train"), (test_data, save_path + "dev"))
+
+    for data, name in splits:
+        # SAVE IN CONLL
+        if save_config.get("save_into_conll", True):
+            utils.pandas2conll(data, name + ".conll" + extension)
+        # SAVE IN JSON
+        if save_config.get("save_into_json", True):
+            utils.pandas2json(
+                data,
+                name + ".json" + extension,
+                fast_json=save_config.get("fast_json", False),
+            )
+        # SAVE IN PARQUET
+        if save_config.get("save_into_parquet", False):
+            utils.pandas2parquet(
+                data,
+                name + ".parquet",
+                row_group_size=save_config.get("parquet_row_group_size", 10000),
+                tag_names=tag_names,
+            )
+
+
+def process_fold(
+    fold,
+    train_data,
+    test_data,
+    save_folder,
+    config,
+    tag_names=None,
+    full_stats=None,
+    groups=None,
+):
+    """Stats, balancing and files of one fold
+
+    Writes fold-{fold}/ with the (balanced) splits, stats.txt and
+    preprocessing_snapshot.yaml. The seed is fixed to UTILS.random_state + fold,
+    so a fold gives the same result in any process and in any order.
+
+    Args:
+        fold (int): fold number
+        train_data (pd.DataFrame): train split
+        test_data (pd.DataFrame): dev split
+        save_folder (str): SAVE.save_folder
+        config (DictConfig): all settings in settings.yaml
+        tag_names (List[str], optional): vocabulary of the parquet tag ids
+        full_stats (StatsAccumulator, optional): stats of train + dev, the train
+            stats are then full_stats - dev stats, computed in O(dev)
+        groups (np.ndarray, optional): original sentence of each row of the
+            dataset (indexed by the DataFrame index), the balancing then moves
+            the windows of a sentence together, see {split_folds}
+    """
+    utils.fix_seed(config["UTILS"].get("random_state", 0) + fold)
+
+    save_path = save_folder + "/" + "fold-" + str(fold) + "/"  # PATH TO SAVE
+    os.makedirs(save_path)  # CREATE THE FOLDER VERSION AND SUBFOLDER
+
+    # FOLD ANALYSIS
+    stats = []
+    analysis_train, analysis_test = _fold_analysis(
+        train_data, test_data, full_stats, length_thresholds(config)
+    )
+    stats.extend(
+        analysis_train.generate_dataset_info(n_fold=fold, train_data=True)
+    )  # TRAIN DATA
+    stats.extend(
+        analysis_test.generate_dataset_info(n_fold=fold, train_data=False)
+    )  # TEST DATA
+
+    if config["PREPROCESSING"].get("balance_folds", True):
+        print("BALANCING FOLD")
+        test_before = test_data
+        # BALANCE IN MEMORY, THE FOLD IS SAVED ONCE BELOW
+        balance_report = None
+        balancing = config.get("BALANCING") or {}
+        if balancing.get("strategy", "greedy") == "global":
+            # ONE OBJECTIVE FOR ALL THE ENTITIES OF THE GROUPS
+            entity_groups = balancing.get("entity_groups")
+            train_data, test_data, balance_report = balance_global(
+                train_data,
+                test_data,
+                entity_groups=(
+                    OmegaConf.to_container(entity_groups)
+                    if OmegaConf.is_config(entity_groups)
+                    else entity_groups
+                ),
+                max_moves=balancing.get("max_moves"),
+            )
+            print("Imbalance {before:.6f} -> {after:.6f}".format(**balance_report))
+        else:
+            train_data, test_data = balance_from_dataframe(train_data, test_data)
+        if groups is not None:
+            train_data, test_data = _keep_groups_together(
+                train_data, test_data, groups, test_before
+            )
+
+        stats.append("*" * 15)
+        stats.append("STATS WITH FOLDS BALANCED")
+        stats.append("*" * 15 + "\n")
+        if balance_report is not None:
+            stats.append(
+                "Imbalance before: {before:.6f}, after: {after:.6f}, "
+                "sentences moved: {moved}\n".format(**balance_report)
+            )
+
+        analysis_train, analysis_test = _fold_analysis(
+            train_data, test_data, full_stats, length_thresholds(config)
+        )
+        stats.extend(
+            analysis_train.generate_dataset_info(n_fold=fold, train_data=True)
+        )  # TRAIN DATA
+        stats.extend(
+            analysis_test.generate_dataset_info(n_fold=fold, train_data=False)
+        )  # TEST DATA
+
+    # SAVE KFOLD SPLIT DATASET
+    save_fold(train_data, test_data, save_path, config["SAVE"], tag_names)
+
+    with open(os.path.join(save_path, "stats.txt"), "w", encoding="utf-8") as f:
+        f.writelines(stats)
+
+    print(f"Save dataset and stats for fold-{fold}")
+
+    with open(
+        os.path.join(save_path, "preprocessing_snapshot.yaml"),
+        "w",
+        encoding="utf-8",
+    ) as f:
+        f.writelines(OmegaConf.to_yaml(config["PREPROCESSING"]))
+
+
+def length_thresholds(config):
+    """STATS.length_thresholds of settings.yaml (256 and 512 when missing)"""
+    return (config.get("STATS") or {}).get("length_thresholds", LENGTH_THRESHOLDS)
+
+
+def _fold_analysis(train_data, test_data, full_stats=None, thresholds=LENGTH_THRESHOLDS):
+    """DatasetAnalysis of the train and dev splits, train = full - dev"""
+    test_stats = StatsAccumulator().update(test_data)
+    if full_stats is None:
+        train_stats = StatsAccumulator().update(train_data)
+    else:
+        train_stats = full_stats.copy().subtract(test_stats).order_as(train_data)
+
+    return (
+        DatasetAnalysis(df=train_stats, length_thresholds=thresholds),
+        DatasetAnalysis(df=test_stats, length_thresholds=thresholds),
+    )
+
+
+def run_folds(df, splits, save_folder, config, n_jobs=1, tag_names=None, groups=None):
+    """Process the folds, in a pool of processes when n_jobs != 1
+
+    The workers do not receive the dataset: it is saved once as a Corpus
+    (SAVE_FOLDER/corpus when SAVE.index_only, otherwise a temporary folder that
+    is removed at the end) and each worker memory-maps it and decodes only the
+    sentences of its fold. Every fold is written by {process_fold}, so the
+    output is the same for any number of processes.
+
+    Args:
+        df (pd.DataFrame): the preprocessed dataset
+        splits (List[Tuple[np.ndarray, np.ndarray]]): train and dev positions
+            of each fold
+        save_folder (str): SAVE.save_folder
+        config (DictConfig): all settings in settings.yaml
+        n_jobs (int, optional): number of processes, None for all cores.
+            Defaults to 1 (serial, in this process).
+        tag_names (List[str], optional): vocabulary of the parquet tag ids
+        groups (np.ndarray, optional): original sentence of each row, see
+            {process_fold}
+    """
+    # STATS OF THE WHOLE DATASET, EACH FOLD ONLY COMPUTES THE STATS OF ITS DEV
+    full_stats = StatsAccumulator().update(df)
+
+    if n_jobs == 1 or len(splits) == 1:
+        for fold, (train_index, test_index) in enumerate(splits):
+            # get the data from indexes
+            train_data, test_data = df.loc[train_index], df.loc[test_index]
+            process_fold(
+                fold,
+                train_data,
+                test_data,
+                save_folder,
+                config,
+                tag_names,
+                full_stats,
+                groups,
+            )
+        return
+
+    shared = os.path.join(save_folder, CORPUS_FOLDER)
+    with tempfile.TemporaryDirectory(dir=save_folder) as tmp:
+        if not config["SAVE"].get("index_only", False):
+            # SHARED ONLY DURING THE RUN
+            shared = os.path.join(tmp, CORPUS_FOLDER)
+            save_corpus(df, tmp)
+
+        args = [
+            (
+                fold,
+                train_index,
+                test_index,
+                shared,
+                save_folder,
+                config,
+                tag_names,
+                full_stats,
+                groups,
+            )
+            for fold, (train_index, test_index) in enumerate(splits)
+        ]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            # list() RAISES THE ERRORS OF THE WORKERS
+            list(executor.map(_run_fold, args))
+
+
+def _run_fold(args):
+    (
+        fold,
+        train_index,
+        test_index,
+        corpus_path,
+        save_folder,
+        config,
+        tag_names,
+        full_stats,
+        groups,
+    ) = args
+    train_data, test_data = (
+        Corpus.load(corpus_path, mmap_mode="r", indices=indices).to_pandas()
+        for indices in (train_index, test_index)
+    )
+    process_fold(
+        fold, train_data, test_data, save_folder, config, tag_names, full_stats, groups
+    )
+
+
+def _keep_groups_together(train_data, test_data, groups, test_before):
+    """Undo the split of a group (the windows of a sentence) by the balancing
+
+    The balancing moves rows one by one; a group split by it follows its moved
+    rows: a group that was in dev goes back whole to train, and vice versa.
+    """
+    train_groups = groups[train_data.index.to_numpy()]
+    test_groups = groups[test_data.index.to_numpy()]
+    split = np.intersect1d(train_groups, test_groups)
+    if not len(split):
+        return train_data, test_data
+
+    was_test = np.isin(split, groups[test_before.index.to_numpy()])
+    to_train = np.isin(test_groups, split[was_test])
+    to_test = np.isin(train_groups, split[~was_test])
+
+    return (
+        pd.concat([train_data[~to_test], test_data[to_train]]),
+        pd.concat([test_data[~to_train], train_data[to_test]]),
+    )
@@ -0,0 +1,136 @@
+import mmap
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+
+# one or more blank lines between two sentences
+_BOUNDARY = re.compile(rb"\n(?:[ \t\r]*\n)+")
+_LEADING_BLANK_LINES = re.compile(rb"(?:[ \t\r]*\n)*")
+
+
+class MmapConll:
+    """Random access to the sentences of a conll file without parsing it
+
+    The file is memory-mapped and the byte range of every sentence is found in
+    a single scan. The index is saved next to the file (`<path>.sentidx.npz`)
+    and reused while the file size and mtime do not change. Only the sentences
+    that are accessed are decoded.
+
+        conll = MmapConll("dataset.conll")
+        len(conll)          # number of sentences
+        conll[10]           # (words, tags) of sentence 10
+        conll[10:20]        # list of (words, tags)
+        conll.to_pandas([3, 7, 42])
+
+    Args:
+        path (str): filename (eg. dataset.conll), uncompressed
+        sep (str, optional): column separator. Defaults to ' '.
+        columns (tuple, optional): column of each token to extract, as in
+            `utils.iter_conll_sentences`. Defaults to (0, -1).
+        index_path (str, optional): where to persist the sentence index.
+            Defaults to `<path>.sentidx.npz`, False disables persistence.
+    """
+
+    def __init__(self, path: str, sep=" ", columns=(0, -1), index_path=None):
+        if utils.infer_compression(path):
+            raise ValueError(f"{path} is compressed, it cannot be memory-mapped")
+
+        self.path = path
+        self.sep = sep
+        self.columns = columns
+        self.index_path = path + ".sentidx.npz" if index_path is None else index_path
+
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+        self.starts, self.ends = self._load_or_build_index()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._decode(i) for i in range(*item.indices(len(self)))]
+        if np.ndim(item) > 0:
+            return [self._decode(i) for i in np.asarray(item, dtype=np.int64)]
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f"sentence {item} out of range")
+        return self._decode(item)
+
+    def to_pandas(self, indices=None):
+        """Decode the sentences at `indices` (all by default) into a DataFrame
+
+        Returns:
+            pd.DataFrame: DataFrame with text and tags cols, indexed by the
+            sentence position in the file
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        sentences = self[indices]
+
+        df = pd.DataFrame(index=indices)
+        df["text"] = [sentence[0] for sentence in sentences]
+        df["tags"] = [sentence[-1] for sentence in sentences]
+
+        return df
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _decode(self, i):
+        text = self._mm[self.starts[i] : self.ends[i]].decode("utf-8")
+        return next(utils.iter_conll_lines(text.split("\n"), self.sep, self.columns))
+
+    def _load_or_build_index(self):
+        stat = os.stat(self.path)
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        if self.index_path and os.path.exists(self.index_path):
+            with np.load(self.index_path) as index:
+                if np.array_equal(index["signature"], signature):
+                    return index["starts"], index["ends"]
+
+        starts, ends = self._scan()
+        if self.index_path:
+            try:
+                with open(self.index_path, "wb") as f:
+                    np.savez(f, starts=starts, ends=ends, signature=signature)
+            except OSError:
+                pass  # read-only folder, the index is just not persisted
+
+        return starts, ends
+
+    def _scan(self):
+        """Byte range [start, end) of every sentence"""
+        mm = self._mm
+        starts = [_LEADING_BLANK_LINES.match(mm).end()]
+        ends = []
+        for boundary in _BOUNDARY.finditer(mm, starts[0]):
+            ends.append(boundary.start())
+            starts.append(boundary.end())
+        ends.append(len(mm))
+
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+
+        # trailing blank lines at the end of the file
+        if len(starts) and not mm[starts[-1] : ends[-1]].strip():
+            starts, ends = starts[:-1], ends[:-1]
+
+        return starts, ends
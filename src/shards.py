@@ -0,0 +1,81 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.cache import ParseCache, load_conll
+from src.corpus import Corpus
+
+
+def expand_files(files, folder=""):
+    """List the conll shards matched by `files`
+
+    Args:
+        files (str | List[str]): a glob (eg. 'shards/*.conll') or a list of
+            globs/filenames, relative to `folder`
+        folder (str, optional): base folder. Defaults to ''.
+
+    Returns:
+        List[str]: the shard filenames relative to `folder`. Each glob is
+        sorted, a list keeps its order, so the result is deterministic.
+    """
+    if isinstance(files, str):
+        files = [files]
+
+    shards = []
+    for pattern in files:
+        matches = sorted(glob.glob(os.path.join(folder, pattern)))
+        assert matches, f"No file matches {os.path.join(folder, pattern)}"
+        shards.extend(os.path.relpath(m, folder) if folder else m for m in matches)
+
+    return shards
+
+
+def load_conll_files(
+    files, folder="", sep=" ", cache_dir=None, max_size_mb=2048, n_jobs=None
+):
+    """Parse many conll shards in parallel and merge them in order
+
+    Each shard is parsed by a process of the pool (through the ParseCache when
+    `cache_dir` is set), the corpora are concatenated in the order of
+    `expand_files`, so the result does not depend on the number of processes.
+    The cache is evicted once, here, after every shard is loaded: a worker
+    never removes an entry that another worker is reading.
+
+    Args:
+        files (str | List[str]): glob or list of shards, see {expand_files}
+        folder (str, optional): base folder of the shards. Defaults to ''.
+        sep (str, optional): column separator. Defaults to ' '.
+        cache_dir (str, optional): folder of the parse cache, None disables it.
+        max_size_mb (float, optional): size limit of the cache. Defaults to 2048.
+        n_jobs (int, optional): number of processes. Defaults to None (all cores).
+
+    Returns:
+        Corpus: the merged corpus, its `source_file` holds the shard filename
+        (relative to `folder`) of each sentence
+    """
+    shards = expand_files(files, folder)
+    paths = [os.path.join(folder, shard) for shard in shards]
+    args = [(path, sep, cache_dir, max_size_mb) for path in paths]
+
+    if n_jobs == 1 or len(paths) == 1:
+        corpora = [_load_shard(arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            corpora = list(executor.map(_load_shard, args))
+
+    if cache_dir:
+        ParseCache(cache_dir, max_size_mb=max_size_mb).evict()
+
+    for shard, corpus in zip(shards, corpora):
+        corpus.source_file = np.full(len(corpus), shard, dtype=object)
+
+    return Corpus.concat(corpora)
+
+
+def _load_shard(args):
+    path, sep, cache_dir, max_size_mb = args
+    return load_conll(
+        path, sep, cache_dir=cache_dir, max_size_mb=max_size_mb, evict=False
+    )
@@ -0,0 +1,243 @@
+import hashlib
+import math
+
+import numpy as np
+
+
+def _hash64(value: str, seed=0):
+    """Stable 64 bits hash of a string (the builtin hash changes per process)"""
+    digest = hashlib.blake2b(
+        value.encode("utf-8"), digest_size=8, salt=seed.to_bytes(16, "little")
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def stable_seed(value: str, seed=0):
+    """32 bits seed (for np.random.RandomState) derived from a string and a seed"""
+    return _hash64(value, seed) & 0xFFFFFFFF
+
+
+class KLLSketch:
+    """Quantile sketch (Karnin, Lang and Liberty, 2016) of a stream of numbers
+
+    Keeps O(k) items in compactors of growing weight: a full compactor is
+    sorted and every other item (random offset) is promoted to the next level
+    with twice the weight. Sketches of different parts of a stream can be
+    merged.
+
+    Args:
+        k (int, optional): size of the top compactor, the rank error is about
+            `rank_error` (~1.65% of n for k=200). Defaults to 200.
+        seed (int, optional): seed of the compaction offsets. Defaults to 0.
+    """
+
+    def __init__(self, k=200, seed=0):
+        assert k >= 8, "k must be at least 8"
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self._rng = np.random.RandomState(seed)
+
+    @property
+    def rank_error(self):
+        """Normalized rank error with 99% confidence (DataSketches estimate)"""
+        return 2.446 / self.k**0.9433
+
+    def update(self, values):
+        """Add an iterable of numbers"""
+        values = list(values)
+        start = 0
+        while start < len(values):
+            # FILL THE FIRST COMPACTOR, THEN COMPRESS
+            stop = start + max(self._capacity(0) - len(self.compactors[0]), 1)
+            self.compactors[0].extend(values[start:stop])
+            self.n += len(values[start:stop])
+            start = stop
+            if len(self.compactors[0]) >= self._capacity(0):
+                self._compress()
+
+        return self
+
+    def merge(self, other):
+        """Add the items of another sketch"""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self._compress()
+
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1) of the numbers added"""
+        assert 0 <= q <= 1, "q must be between 0 and 1"
+        if not self.n:
+            return None
+
+        items, weights = self._weighted_items()
+        cumulative = np.cumsum(weights)
+        position = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return items[min(position, len(items) - 1)]
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 8)
+
+    def _compress(self):
+        capacities = [self._capacity(level) for level in range(len(self.compactors))]
+        while sum(map(len, self.compactors)) >= sum(capacities):
+            level = next(
+                level
+                for level, items in enumerate(self.compactors)
+                if len(items) >= capacities[level]
+            )
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+                capacities = [
+                    self._capacity(level) for level in range(len(self.compactors))
+                ]
+
+            items = sorted(self.compactors[level])
+            # AN ODD ITEM STAYS IN THE LEVEL
+            kept = [items.pop()] if len(items) % 2 else []
+            self.compactors[level + 1].extend(items[self._rng.randint(2) :: 2])
+            self.compactors[level] = kept
+
+    def _weighted_items(self):
+        items, weights = [], []
+        for level, values in enumerate(self.compactors):
+            items.extend(values)
+            weights.extend([2**level] * len(values))
+        order = np.argsort(items, kind="stable")
+
+        return np.asarray(items)[order], np.asarray(weights)[order]
+
+
+class HyperLogLog:
+    """Distinct count estimator (Flajolet et al., 2007) in 2^p registers
+
+    Args:
+        p (int, optional): precision, 2^p one byte registers and a relative
+            standard error of 1.04 / sqrt(2^p) (1.6% for p=12). Defaults to 12.
+    """
+
+    def __init__(self, p=12):
+        assert 4 <= p <= 18, "p must be between 4 and 18"
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        """Relative standard error of the estimate"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def update(self, values):
+        """Add an iterable of strings"""
+        for value in values:
+            h = _hash64(value)
+            register = h >> (64 - self.p)
+            rest = h & ((1 << (64 - self.p)) - 1)
+            rank = (64 - self.p) - rest.bit_length() + 1
+            if rank > self.registers[register]:
+                self.registers[register] = rank
+
+        return self
+
+    def merge(self, other):
+        assert self.p == other.p, "Different precisions"
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # SMALL RANGE CORRECTION (LINEAR COUNTING)
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """Frequency estimator (Cormode and Muthukrishnan, 2005)
+
+    The estimate never underestimates and overestimates by at most
+    e / width * total with probability 1 - exp(-depth).
+
+    Args:
+        width (int, optional): counters per row. Defaults to 2048.
+        depth (int, optional): rows (independent hashes). Defaults to 5.
+    """
+
+    def __init__(self, width=2048, depth=5):
+        assert width > 0 and depth > 0, "width and depth must be positive"
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    @property
+    def error(self):
+        """Max overestimation of a count, with probability `confidence`"""
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self):
+        return 1 - math.exp(-self.depth)
+
+    def add(self, value: str, count=1):
+        for row in range(self.depth):
+            self.table[row, _hash64(value, row) % self.width] += count
+        self.total += count
+
+    def update(self, counts):
+        """Add a mapping value -> count (eg. a Counter of a batch)"""
+        for value, count in counts.items():
+            self.add(value, count)
+
+        return self
+
+    def merge(self, other):
+        assert self.table.shape == other.table.shape, "Different shapes"
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def estimate(self, value: str):
+        return int(
+            min(
+                self.table[row, _hash64(value, row) % self.width]
+                for row in range(self.depth)
+            )
+        )
+
+
+class ReservoirSample:
+    """Uniform sample of up to `size` items of a stream (Vitter's algorithm R)
+
+    Args:
+        size (int, optional): sample size. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 0.
+    """
+
+    def __init__(self, size=3, seed=0):
+        assert size > 0, "size must be positive"
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self._rng = np.random.RandomState(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+
+        position = self._rng.randint(self.seen)
+        if position < self.size:
+            self.items[position] = item
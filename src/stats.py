@@ -1,46 +1,214 @@
 import os
 from collections import Counter
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
+
+from src import utils
+from src.corpus import Corpus
+from src.entity_index import EntitySpans
+from src.sketches import (
+    CountMinSketch,
+    HyperLogLog,
+    KLLSketch,
+    ReservoirSample,
+    stable_seed,
+)
+
+
+# sentences longer than each threshold are counted by Stats
+LENGTH_THRESHOLDS = (256, 512)
+
+
+class StatsAccumulator:
+    """Mergeable, one pass accumulator of the dataset statistics of {Stats}
+
+    Consumes batches of sentences and keeps only a histogram of the sentence
+    lengths, the number of negative sentences, the count of each entity
+    (B- tags) and, from the decoded spans (see {EntitySpans}), a histogram of
+    the span lengths of each entity, the malformed spans (I- without B-) and
+    the sentence co-occurrence of each pair of entities, so the partial results
+    of different batches (or processes) can be added with `merge` and removed
+    with `subtract`:
+
+        full = StatsAccumulator().update(df)
+        dev = StatsAccumulator().update(df.loc[test_index])
+        train = full.copy().subtract(dev).order_as(df.loc[train_index])
+        train.get_stats() == Stats(df.loc[train_index]).get_stats()
+
+    The entities keep the order of their first appearance, like Counter: the
+    order of the batches for `update` and `merge`, the order of the minuend for
+    `subtract`. That order only shows in {Stats} between the entities with
+    equal counts, which `order_as` puts in their order of first appearance in
+    the remaining sentences (O(dev) plus a scan of the first train sentences).
+    """
+
+    def __init__(self):
+        self.n_sentences = 0
+        self.n_null_sentences = 0
+        # SENTENCES WITH EACH LENGTH, KEEPS MIN AND MAX DERIVABLE AFTER subtract
+        self.length_histogram = np.zeros(0, dtype=np.int64)
+        self.entity_counts = {}
+        # SPANS OF EACH ENTITY WITH EACH LENGTH
+        self.span_lengths = {}
+        self.malformed_spans = {}
+        # (entity, entity) -> SENTENCES WITH BOTH
+        self.cooccurrence = {}
+
+    def update(self, batch):
+        """Add a batch of sentences
+
+        Args:
+            batch (pd.DataFrame | Corpus): sentences with text and tags
+
+        Returns:
+            StatsAccumulator: self
+        """
+        corpus = batch if isinstance(batch, Corpus) else Corpus.from_pandas(batch)
+        histogram, n_null_sentences, counts = _stats_kernel(corpus)
+
+        self._add_histogram(histogram)
+        self.n_sentences += len(corpus)
+        self.n_null_sentences += n_null_sentences
+        for entity, count in counts.items():
+            self.entity_counts[entity] = self.entity_counts.get(entity, 0) + count
+        self._add_spans(*_span_kernel(corpus))
+
+        return self
+
+    def merge(self, other):
+        """Add the statistics of another accumulator (its batches after ours)"""
+        self._add_histogram(other.length_histogram)
+        self.n_sentences += other.n_sentences
+        self.n_null_sentences += other.n_null_sentences
+        for entity, count in other.entity_counts.items():
+            self.entity_counts[entity] = self.entity_counts.get(entity, 0) + count
+        self._add_spans(other.span_lengths, other.malformed_spans, other.cooccurrence)
+
+        return self
+
+    def subtract(self, other):
+        """Remove the statistics of a subset of our sentences (eg. train = full - dev)"""
+        self._add_histogram(-other.length_histogram)
+        self.n_sentences -= other.n_sentences
+        self.n_null_sentences -= other.n_null_sentences
+        for entity, count in other.entity_counts.items():
+            self.entity_counts[entity] = self.entity_counts.get(entity, 0) - count
+        self.entity_counts = {k: v for k, v in self.entity_counts.items() if v != 0}
+        self._add_spans(
+            {k: -v for k, v in other.span_lengths.items()},
+            {k: -v for k, v in other.malformed_spans.items()},
+            {k: -v for k, v in other.cooccurrence.items()},
+        )
+
+        assert (
+            self.n_sentences >= 0
+            and (self.length_histogram >= 0).all()
+            and all((v >= 0).all() for v in self.span_lengths.values())
+        ), "Subtracted sentences that were not accumulated"
+        return self
+
+    def order_as(self, batch):
+        """Order the entities like `update(batch)` would, eg. after `subtract`
+
+        Only the order that shows in {Stats} is fixed: the entities with equal
+        counts (first B- tag) and the entities with spans but no count (first
+        tag). The tags of `batch` are scanned until every one of them is found.
+
+        Args:
+            batch (pd.DataFrame | Corpus): the sentences accumulated
+
+        Returns:
+            StatsAccumulator: self
+        """
+        repeated = Counter(self.entity_counts.values())
+        tied = {k for k, v in self.entity_counts.items() if repeated[v] > 1}
+        span_only = {k for k in self.span_lengths if k not in self.entity_counts}
+        if len(span_only) < 2:
+            span_only = set()
+        if not tied and not span_only:
+            return self
+
+        first_b, first_tag = {}, {}
+        sentences = batch.to_pandas() if isinstance(batch, Corpus) else batch
+        position = 0
+        for tags in sentences["tags"]:
+            for tag in tags:
+                if tag != "O":
+                    first_tag.setdefault(tag[2:], position)
+                    if tag[0] == "B":
+                        first_b.setdefault(tag[2:], position)
+                position += 1
+            if tied <= first_b.keys() and span_only <= first_tag.keys():
+                break
+
+        self.entity_counts = _reorder(self.entity_counts, tied, first_b)
+        self.span_lengths = _reorder(self.span_lengths, span_only, first_tag)
+        return self
+
+    def copy(self):
+        return StatsAccumulator().merge(self)
+
+    def get_stats(self):
+        """Same dict as {Stats.get_stats}"""
+        return Stats(self).get_stats()
+
+    def _add_histogram(self, histogram):
+        self.length_histogram = _add_histograms(self.length_histogram, histogram)
+
+    def _add_spans(self, span_lengths, malformed_spans, cooccurrence):
+        for entity, histogram in span_lengths.items():
+            total = _add_histograms(
+                self.span_lengths.get(entity, np.zeros(0, dtype=np.int64)), histogram
+            )
+            if len(total):
+                self.span_lengths[entity] = total
+            else:
+                self.span_lengths.pop(entity, None)
+        for counts, other in (
+            (self.malformed_spans, malformed_spans),
+            (self.cooccurrence, cooccurrence),
+        ):
+            for key, count in other.items():
+                counts[key] = counts.get(key, 0) + count
+                if counts[key] == 0:
+                    del counts[key]
 
 
 class Stats:
-    def __init__(self, df):
-        self.df = df
+    def __init__(self, df, length_thresholds=LENGTH_THRESHOLDS):
+        if isinstance(df, StatsAccumulator):
+            self.accumulator = df
+        else:
+            # a DataFrame or a Corpus, not modified
+            self.accumulator = StatsAccumulator().update(df)
+        self.length_thresholds = list(length_thresholds)
         self._prepare_stats()
 
     def _prepare_stats(self):
-        self.df["quantidadeTokens"] = self.df["text"].apply(len)
-
-        # percorrendo todo o dataset['tags'] e verificando se todos os elementos são nulos
-        self.df["isSentenceNull"] = self.df["tags"].apply(
-            lambda x: all([i == "O" for i in x])
-        )
-
-        tokens_described = self.df["quantidadeTokens"].describe()
+        acc = self.accumulator
+        lengths = np.arange(len(acc.length_histogram))
 
         # QUANTIDADE DE SENTENÇAS/MAX/MEDIA E MIN
         # atributes
-        self.count_sentences = tokens_described["count"].astype(int)
-        self.max_token = tokens_described["max"].astype(int)
-        self.min_token = tokens_described["min"].astype(int)
-        self.mean_token = tokens_described["mean"].round(2)
+        self.count_sentences = np.int64(acc.n_sentences)
+        self.max_token = lengths[-1] if acc.n_sentences else np.int64(0)
+        self.min_token = (
+            np.flatnonzero(acc.length_histogram)[0] if acc.n_sentences else np.int64(0)
+        )
         # QUANTIDADE TOTAL DE TOKENS
-        self.len_tokens = self.df["quantidadeTokens"].sum()
-        # QUANTIDADE DE SENTENÇAS COMPLETAMENTE VAZIAS (SENTENÇAS NEGATIVAS)
-        self.len_null_sentences = self.df["isSentenceNull"].sum()
-
-        tags = np.array(
-            [tag[2:] for tags in self.df["tags"] for tag in tags if tag[0] == "B"]
+        self.len_tokens = (lengths * acc.length_histogram).sum()
+        self.mean_token = (
+            np.round(self.len_tokens / acc.n_sentences, 2) if acc.n_sentences else np.nan
         )
+        # QUANTIDADE DE SENTENÇAS COMPLETAMENTE VAZIAS (SENTENÇAS NEGATIVAS)
+        self.len_null_sentences = np.int64(acc.n_null_sentences)
 
-        labels = dict(Counter(tags).most_common())
+        # ORDEM DE PRIMEIRA APARIÇÃO, COMO O Counter
+        labels = dict(Counter(acc.entity_counts).most_common())
 
         self.len_labels = len(labels)
-        self.len_tags = len(tags)
+        self.len_tags = sum(labels.values())
 
         # ORDEM DECRESCENTE DO LABELS E RETIRANDO _
         self.labels = {
@@ -51,46 +219,103 @@ class Stats:
         self.labels_ratio = {
             k: (v / sum(self.labels.values())) for k, v in self.labels.items()
         }
-        # QUANTIDADE DE SENTENCAS ACIMA DE 256 TOKENS
-        self.sentences_over_256 = self.df[self.df["quantidadeTokens"] > 256].count()[
-            "text"
-        ]
-        # QUANTIDADE DE SENTENCAS ACIMA DE 512 TOKENS
-        self.sentences_over_512 = self.df[self.df["quantidadeTokens"] > 512].count()[
-            "text"
-        ]
+        # QUANTIDADE DE SENTENCAS ACIMA DE CADA LIMITE (256, 512 TOKENS...)
+        self.sentences_over = {
+            threshold: acc.length_histogram[threshold + 1 :].sum()
+            for threshold in self.length_thresholds
+        }
 
         self.negative_sentence_ratio = self.len_null_sentences / self.count_sentences
 
+        # SPANS DE CADA ENTIDADE, NA ORDEM DOS LABELS (ENTIDADES SÓ COM I- NO FIM)
+        entities = sorted(labels, key=labels.get, reverse=True)
+        entities += [k for k in acc.span_lengths if k not in labels]
+        entities = [k for k in entities if k in acc.span_lengths]
+        self.span_lengths = {
+            k.replace("_", " "): {
+                length: int(count)
+                for length, count in enumerate(acc.span_lengths[k])
+                if count
+            }
+            for k in entities
+        }
+        self.spans = {k: sum(v.values()) for k, v in self.span_lengths.items()}
+        # QUANTIDADE DE TOKENS DE CADA ENTIDADE E MÉDIA DE TOKENS POR ENTIDADE
+        self.span_tokens = {
+            k: sum(length * count for length, count in v.items())
+            for k, v in self.span_lengths.items()
+        }
+        self.span_mean = {
+            k: round(self.span_tokens[k] / self.spans[k], 2) for k in self.spans
+        }
+        self.span_max = {k: max(v) for k, v in self.span_lengths.items()}
+        # SEQUÊNCIAS BIO MALFORMADAS (I- SEM B-)
+        self.malformed = {
+            k.replace("_", " "): acc.malformed_spans.get(k, 0) for k in entities
+        }
+        self.len_malformed = sum(acc.malformed_spans.values())
+        # SENTENÇAS COM CADA PAR DE ENTIDADES (DIAGONAL: SENTENÇAS COM A ENTIDADE)
+        self.cooccurrence = {
+            a.replace("_", " "): {
+                b.replace("_", " "): acc.cooccurrence.get((a, b), 0) for b in entities
+            }
+            for a in entities
+        }
+
     def get_stats(self):
         # Token section
         infos = {
             "Quantidade de Sentenças": self.count_sentences,  # int
             "Quantidade de Sentenças Negativas": self.len_null_sentences,  # int
-            "Quantidade de Sentenças acima de 256 tokens": self.sentences_over_256,  # int
-            "Quantidade de Sentenças acima de 512 tokens": self.sentences_over_512,  # int
-            "Quantidade de Tokens": self.len_tokens,  # int
-            "Tamanho da maior Sentença (tokens)": self.max_token,  # int
-            "Tamanho médio das Sentenças": self.mean_token,  # int
-            "Quantidade de Entidades": self.len_tags,  # int
-            "Quantidade de Classes": self.len_labels,  # int
-            "Razão de Sentenças Negativas": self.negative_sentence_ratio,  # float
-            "Labels": self.labels,  # dict
-            "Labels Ratio": self.labels_ratio,  # dict
         }
+        for threshold, count in self.sentences_over.items():
+            infos[f"Quantidade de Sentenças acima de {threshold} tokens"] = count  # int
+        infos.update(
+            {
+                "Quantidade de Tokens": self.len_tokens,  # int
+                "Tamanho da maior Sentença (tokens)": self.max_token,  # int
+                "Tamanho médio das Sentenças": self.mean_token,  # int
+                "Quantidade de Entidades": self.len_tags,  # int
+                "Quantidade de Classes": self.len_labels,  # int
+                "Razão de Sentenças Negativas": self.negative_sentence_ratio,  # float
+                "Quantidade de Sequências BIO Malformadas": self.len_malformed,  # int
+                "Labels": self.labels,  # dict
+                "Labels Ratio": self.labels_ratio,  # dict
+                "Spans por Entidade": self.spans,  # dict
+                "Tokens por Entidade": self.span_tokens,  # dict
+                "Tamanho médio das Entidades": self.span_mean,  # dict
+                "Tamanho máximo das Entidades": self.span_max,  # dict
+                "Sequências BIO Malformadas": self.malformed,  # dict
+                "Distribuição do Tamanho das Entidades": self.span_lengths,  # dict
+                "Coocorrência de Entidades": self.cooccurrence,  # dict
+            }
+        )
         return infos
 
 
 class DatasetAnalysis:
-    def __init__(self, df):
+    def __init__(self, df, length_thresholds=LENGTH_THRESHOLDS):
         self.df = df
-        self.stats = Stats(self.df).get_stats()
+        self.length_thresholds = list(length_thresholds)
+        self.stats = Stats(self.df, self.length_thresholds).get_stats()
         self.FIG_PATH = "figs_outputs"
 
     def convert_stats2excel(self, save_path=""):
         token_infos = self.stats.copy()
         labels = token_infos.pop("Labels")
         labels_ratio = token_infos.pop("Labels Ratio")
+        span_lengths = token_infos.pop("Distribuição do Tamanho das Entidades")
+        cooccurrence = token_infos.pop("Coocorrência de Entidades")
+        span_infos = {
+            k: token_infos.pop(k)
+            for k in (
+                "Spans por Entidade",
+                "Tokens por Entidade",
+                "Tamanho médio das Entidades",
+                "Tamanho máximo das Entidades",
+                "Sequências BIO Malformadas",
+            )
+        }
 
         excel_sheet1 = {
             # COLUMN        # ROWS
@@ -114,6 +339,17 @@ class DatasetAnalysis:
             writer, sheet_name="Entidades"
         )
 
+        pd.DataFrame.from_dict(span_infos, orient="columns").to_excel(
+            writer, sheet_name="Spans"
+        )
+
+        # LINHAS: TAMANHO DO SPAN (TOKENS), COLUNAS: ENTIDADES
+        pd.DataFrame(span_lengths).sort_index().fillna(0).astype(int).to_excel(
+            writer, sheet_name="Tamanho dos Spans"
+        )
+
+        pd.DataFrame(cooccurrence).to_excel(writer, sheet_name="Coocorrência")
+
         writer.close()
 
     def generate_dataset_info(self, is_alldata=False, n_fold=0, train_data=True) -> str:
@@ -151,14 +387,12 @@ class DatasetAnalysis:
             {self.stats['Quantidade de Sentenças Negativas']}\n\n"""
         )
 
-        text.append(
-            f"""O dataset possui {str(self.stats['Quantidade de Sentenças acima de 256 tokens'])}
-            sentenças com tamanho maior que 256 tokens\n\n"""
-        )
-        text.append(
-            f"""O dataset possui {str(self.stats['Quantidade de Sentenças acima de 512 tokens'])}
-            sentenças com tamanho maior que 512 tokens\n\n"""
-        )
+        for threshold in self.length_thresholds:
+            over = self.stats[f"Quantidade de Sentenças acima de {threshold} tokens"]
+            text.append(
+                f"""O dataset possui {str(over)}
+            sentenças com tamanho maior que {threshold} tokens\n\n"""
+            )
 
         text.append(
             f"Quantidade de classes: {str(self.stats['Quantidade de Classes'])}\n"
@@ -173,9 +407,46 @@ class DatasetAnalysis:
             text.append(k + ": " + str(v) + " entidades\n")
         text.append("-" * 15 + "\n\n")
 
+        # SPANS
+        text.append(
+            "Sequências BIO malformadas (I- sem B-): "
+            f"{self.stats['Quantidade de Sequências BIO Malformadas']}\n\n"
+        )
+        for k, spans in self.stats["Spans por Entidade"].items():
+            text.append(
+                f"{k}: {spans} spans, "
+                f"{self.stats['Tokens por Entidade'][k]} tokens, "
+                f"{self.stats['Tamanho médio das Entidades'][k]} tokens por entidade "
+                f"(máximo {self.stats['Tamanho máximo das Entidades'][k]}), "
+                f"{self.stats['Sequências BIO Malformadas'][k]} malformadas\n"
+            )
+        text.append("-" * 15 + "\n\n")
+
+        # COOCORRÊNCIA, PARES EM ORDEM DECRESCENTE
+        cooccurrence = self.stats["Coocorrência de Entidades"]
+        entities = list(cooccurrence)
+        pairs = [
+            (a, b, cooccurrence[a][b])
+            for i, a in enumerate(entities)
+            for b in entities[i + 1 :]
+            if cooccurrence[a][b]
+        ]
+        text.append("Sentenças com cada par de entidades:\n")
+        for a, b, count in sorted(pairs, key=lambda pair: pair[2], reverse=True):
+            text.append(f"{a} + {b}: {count} sentenças\n")
+        text.append("-" * 15 + "\n\n")
+
         return text
 
     def plot_graphs(self, save_path="", verbose=False):
+        # IMPORTED ONLY TO PLOT, WITHOUT A GUI BACKEND UNLESS THE FIGURES ARE SHOWN
+        import matplotlib
+
+        if not verbose:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         if not os.path.exists(os.path.join(save_path, self.FIG_PATH)):
             os.makedirs(os.path.join(save_path, "figs_outputs"))
 
@@ -212,3 +483,333 @@ class DatasetAnalysis:
         plt.savefig(os.path.join(save_path, self.FIG_PATH, title))
         if verbose:
             plt.show()
+
+
+class ApproxDatasetAnalysis:
+    """Approximate profile of a conll file in bounded memory
+
+    Streams the file in batches of sentences (it is never fully loaded) and
+    keeps, besides the exact counters (sentences, tokens, negatives, lengths
+    over each threshold, max and mean):
+
+    - a KLLSketch of the sentence lengths, for the percentiles
+    - a HyperLogLog per entity of its distinct tokens
+    - a CountMinSketch of the tag frequencies
+    - a ReservoirSample per entity of example sentences
+
+    Every approximate figure of `generate_dataset_info` comes with its error
+    bound.
+
+        analysis = ApproxDatasetAnalysis("crawl.conll.gz")
+        print("".join(analysis.generate_dataset_info()))
+
+    Args:
+        path (str): filename (eg. dataset.conll or dataset.conll.gz)
+        sep (str, optional): column separator. Defaults to ' '.
+        length_thresholds (tuple, optional): see {Stats}. Defaults to (256, 512).
+        percentiles (tuple, optional): sentence length percentiles to report.
+            Defaults to (50, 90, 95, 99).
+        batch_size (int, optional): sentences read at a time. Defaults to 10000.
+        kll_k (int, optional): see {KLLSketch}. Defaults to 200.
+        hll_p (int, optional): see {HyperLogLog}. Defaults to 12.
+        cms_width (int, optional): see {CountMinSketch}. Defaults to 2048.
+        cms_depth (int, optional): see {CountMinSketch}. Defaults to 5.
+        n_examples (int, optional): example sentences per entity. Defaults to 3.
+        seed (int, optional): seed of the sketches. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sep=" ",
+        length_thresholds=LENGTH_THRESHOLDS,
+        percentiles=(50, 90, 95, 99),
+        batch_size=10000,
+        kll_k=200,
+        hll_p=12,
+        cms_width=2048,
+        cms_depth=5,
+        n_examples=3,
+        seed=0,
+    ):
+        self.length_thresholds = list(length_thresholds)
+        self.percentiles = list(percentiles)
+        self.n_examples = n_examples
+        self.seed = seed
+        self.hll_p = hll_p
+
+        self.n_sentences = 0
+        self.n_null_sentences = 0
+        self.n_tokens = 0
+        self.max_token = 0
+        self.sentences_over = {threshold: 0 for threshold in self.length_thresholds}
+        self.lengths = KLLSketch(k=kll_k, seed=seed)
+        self.tags = CountMinSketch(width=cms_width, depth=cms_depth)
+        # THE TAG SET IS SMALL (THE SKETCH BOUNDS THE COUNTS, NOT THE NAMES)
+        self.tag_names = {}
+        self.distinct_tokens = {}
+        self.examples = {}
+
+        for batch in utils.iter_conll_sentences(path, sep=sep, batch_size=batch_size):
+            self._update(batch)
+
+        self.stats = self.get_stats()
+
+    def _update(self, batch):
+        lengths = []
+        tag_counts = Counter()
+        entity_tokens = {}
+
+        for words, tags in batch:
+            length = len(words)
+            lengths.append(length)
+            self.max_token = max(self.max_token, length)
+            for threshold in self.length_thresholds:
+                self.sentences_over[threshold] += length > threshold
+
+            tag_counts.update(tags)
+            # IN ORDER OF APPEARANCE (A SET WOULD DEPEND ON PYTHONHASHSEED)
+            entities = {}
+            for word, tag in zip(words, tags):
+                if tag != "O":
+                    entity_tokens.setdefault(tag[2:], []).append(word)
+                    entities[tag[2:]] = None
+            if not entities:
+                self.n_null_sentences += 1
+            for entity in entities:
+                self._entity_examples(entity).add(words)
+
+        self.n_sentences += len(lengths)
+        self.n_tokens += sum(lengths)
+        self.lengths.update(lengths)
+        self.tags.update(tag_counts)
+        self.tag_names.update(dict.fromkeys(tag_counts))
+        for entity, words in entity_tokens.items():
+            if entity not in self.distinct_tokens:
+                self.distinct_tokens[entity] = HyperLogLog(p=self.hll_p)
+            self.distinct_tokens[entity].update(words)
+
+    def _entity_examples(self, entity):
+        if entity not in self.examples:
+            self.examples[entity] = ReservoirSample(
+                self.n_examples, seed=stable_seed(entity, self.seed)
+            )
+        return self.examples[entity]
+
+    def get_stats(self):
+        """Exact counters and sketch estimates, with the error of each sketch"""
+        tag_frequency = {
+            tag: self.tags.estimate(tag) for tag in sorted(self.tag_names)
+        }
+        labels = {
+            tag[2:].replace("_", " "): count
+            for tag, count in tag_frequency.items()
+            if tag[0] == "B"
+        }
+
+        infos = {
+            "Quantidade de Sentenças": self.n_sentences,  # int
+            "Quantidade de Sentenças Negativas": self.n_null_sentences,  # int
+        }
+        for threshold, count in self.sentences_over.items():
+            infos[f"Quantidade de Sentenças acima de {threshold} tokens"] = count  # int
+        infos.update(
+            {
+                "Quantidade de Tokens": self.n_tokens,  # int
+                "Tamanho da maior Sentença (tokens)": self.max_token,  # int
+                "Tamanho médio das Sentenças": (
+                    round(self.n_tokens / self.n_sentences, 2)
+                    if self.n_sentences
+                    else np.nan
+                ),  # float
+                "Razão de Sentenças Negativas": (
+                    self.n_null_sentences / self.n_sentences
+                    if self.n_sentences
+                    else np.nan
+                ),  # float
+                # KLL: ERRO NORMALIZADO DO RANK, 99% DE CONFIANÇA
+                "Percentis do Tamanho das Sentenças": {
+                    q: self.lengths.quantile(q / 100) for q in self.percentiles
+                },  # dict
+                "Erro dos Percentis (rank)": self.lengths.rank_error,  # float
+                # COUNT-MIN: SUPERESTIMA NO MÁXIMO O ERRO, COM A CONFIANÇA
+                "Frequência das Tags": tag_frequency,  # dict
+                "Erro da Frequência das Tags": self.tags.error,  # float
+                "Confiança da Frequência das Tags": self.tags.confidence,  # float
+                "Labels": dict(
+                    sorted(labels.items(), key=lambda item: item[1], reverse=True)
+                ),  # dict
+                # HYPERLOGLOG: ERRO PADRÃO RELATIVO
+                "Tokens Distintos por Entidade": {
+                    entity.replace("_", " "): hll.count()
+                    for entity, hll in self.distinct_tokens.items()
+                },  # dict
+                "Erro dos Tokens Distintos": 1.04 / np.sqrt(1 << self.hll_p),  # float
+                "Exemplos por Entidade": {
+                    entity.replace("_", " "): [" ".join(words) for words in sample.items]
+                    for entity, sample in self.examples.items()
+                },  # dict
+            }
+        )
+        return infos
+
+    def generate_dataset_info(self) -> str:
+        stats = self.stats
+        n_sentences = stats["Quantidade de Sentenças"]
+        rank_error = stats["Erro dos Percentis (rank)"]
+        tag_error = stats["Erro da Frequência das Tags"]
+        confidence = stats["Confiança da Frequência das Tags"]
+        distinct_error = stats["Erro dos Tokens Distintos"]
+
+        text = ["Processing ALL dataset statistics (approximate) \n\n"]
+
+        text.append(
+            f"Razão de Sentenças Negativas {stats['Razão de Sentenças Negativas']}\n"
+        )
+        text.append(f"{n_sentences} sentences\n")
+        text.append(f"{stats['Quantidade de Tokens']} tokens\n")
+        text.append("\n")
+        text.append(
+            f"O tamanho médio das sentenças é: "
+            f"{stats['Tamanho médio das Sentenças']} tokens\n"
+        )
+        text.append(
+            f"O tamanho máximo das sentenças é: "
+            f"{stats['Tamanho da maior Sentença (tokens)']} tokens\n"
+        )
+        text.append(
+            f"A quantidade de sentenças sem entidades: "
+            f"{stats['Quantidade de Sentenças Negativas']}\n\n"
+        )
+        for threshold in self.length_thresholds:
+            over = stats[f"Quantidade de Sentenças acima de {threshold} tokens"]
+            text.append(
+                f"O dataset possui {over} sentenças com tamanho maior que "
+                f"{threshold} tokens\n"
+            )
+        text.append("\n")
+
+        text.append(
+            f"Percentis do tamanho das sentenças (rank ± {rank_error:.2%}, "
+            f"± {int(np.ceil(rank_error * n_sentences))} sentenças, 99% de confiança):\n"
+        )
+        for q, value in stats["Percentis do Tamanho das Sentenças"].items():
+            text.append(f"p{q}: {value} tokens\n")
+
+        text.append("\n\n" + "-" * 15 + "\n\n")
+        text.append(
+            f"Frequência das tags (superestimada em até {int(np.ceil(tag_error))}, "
+            f"{confidence:.1%} de confiança):\n"
+        )
+        for tag, count in stats["Frequência das Tags"].items():
+            text.append(f"{tag}: {count} (-{int(np.ceil(tag_error))}/+0)\n")
+
+        text.append("\n\n" + "-" * 15 + "\n\n")
+        text.append(
+            "Tokens distintos por entidade "
+            f"(erro padrão relativo {distinct_error:.2%}):\n"
+        )
+        for entity, count in stats["Tokens Distintos por Entidade"].items():
+            text.append(
+                f"{entity}: {count} ± {int(np.ceil(count * distinct_error))} "
+                "tokens distintos\n"
+            )
+
+        text.append("\n\n" + "-" * 15 + "\n\n")
+        text.append("Exemplos de sentenças por entidade:\n")
+        for entity, sentences in stats["Exemplos por Entidade"].items():
+            text.append(entity + ":\n")
+            for sentence in sentences:
+                text.append("    " + sentence + "\n")
+        text.append("-" * 15 + "\n\n")
+
+        return text
+
+
+def _reorder(items, keys, positions):
+    """items with `keys` sorted by `positions`, in the slots they already take"""
+    moved = iter(sorted((k for k in items if k in keys), key=positions.get))
+    order = [next(moved) if k in keys else k for k in items]
+    return {k: items[k] for k in order}
+
+
+def _add_histograms(histogram, other):
+    """Sum of two histograms of different sizes, without trailing zeros"""
+    size = max(len(histogram), len(other))
+    total = np.zeros(size, dtype=np.int64)
+    total[: len(histogram)] += histogram
+    total[: len(other)] += other
+    # NO TRAILING ZEROS, len - 1 IS THE MAX LENGTH
+    size = np.flatnonzero(total)[-1] + 1 if total.any() else 0
+    return total[:size]
+
+
+def _span_kernel(corpus):
+    """Span length histograms, malformed spans and co-occurrence of a Corpus
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], Dict[str, int], Dict[Tuple[str, str], int]]:
+        spans of each entity with each length, spans of each entity starting
+        with I- and sentences with each pair of entities
+    """
+    spans = EntitySpans(corpus)
+    names = spans.type_names
+    histograms = spans.length_histograms()
+    malformed = np.bincount(spans.types[spans.malformed], minlength=len(names))
+    cooccurrence = spans.cooccurrence()
+    pairs = np.argwhere(cooccurrence)
+
+    return (
+        {name: np.trim_zeros(histograms[i], "b") for i, name in enumerate(names)},
+        {name: int(malformed[i]) for i, name in enumerate(names) if malformed[i]},
+        {(names[i], names[j]): int(cooccurrence[i, j]) for i, j in pairs.tolist()},
+    )
+
+
+def _stats_kernel(corpus):
+    """Length histogram, negative sentences and entity counts of a Corpus
+
+    Vectorized over the flat tag ids and the sentence offsets: the lengths are
+    np.diff(offsets), the negative sentences a np.logical_and.reduceat of the
+    'O' tokens and the entity counts a np.bincount of the B- tags.
+
+    Returns:
+        Tuple[np.ndarray, int, Dict[str, int]]: sentences with each length, the
+        number of negative sentences and the count of each entity, in the order
+        of its first appearance
+    """
+    lengths = np.diff(corpus.offsets)
+    tag_ids = np.asarray(corpus.tag_ids)
+    tag_names = corpus.tag_names.tolist()
+
+    # NEGATIVE: EVERY TAG IS 'O' (reduceat IS WRONG FOR EMPTY SENTENCES, ALWAYS NEGATIVE)
+    is_o = np.array([tag == "O" for tag in tag_names], dtype=bool)
+    is_o_token = is_o[tag_ids] if len(is_o) else np.zeros(0, dtype=bool)
+    non_empty = lengths > 0
+    all_o = np.ones(len(lengths), dtype=bool)
+    if non_empty.any():
+        all_o[non_empty] = np.logical_and.reduceat(
+            is_o_token, corpus.offsets[:-1][non_empty]
+        )
+
+    # ENTITY OF EACH B- TAG, THEN ONE bincount
+    entities = {}
+    entity_of_tag = np.array(
+        [
+            entities.setdefault(tag[2:], len(entities)) if tag[0] == "B" else -1
+            for tag in tag_names
+        ],
+        dtype=np.int64,
+    )
+    token_entities = entity_of_tag[tag_ids] if len(tag_ids) else tag_ids
+    token_entities = token_entities[token_entities >= 0]
+    counts = np.bincount(token_entities, minlength=len(entities))
+    present, first = np.unique(token_entities, return_index=True)
+    names = list(entities)
+    ordered = present[np.argsort(first, kind="stable")]
+
+    return (
+        np.bincount(lengths),
+        int(all_o.sum()),
+        {names[entity]: int(counts[entity]) for entity in ordered.tolist()},
+    )
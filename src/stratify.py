@@ -0,0 +1,209 @@
+import numpy as np
+
+from src.corpus import Corpus
+from src.entity_index import EntityIndex
+
+
+def entity_count_matrix(df):
+    """Sentence x entity type matrix with the number of entities (B- tags)
+
+    Args:
+        df (pd.DataFrame | Corpus): dataset with text and tags cols
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: the (n_sentences, n_types) int32 matrix
+        and the entity type of each col
+    """
+    index = EntityIndex(df) if isinstance(df, Corpus) else EntityIndex.from_pandas(df)
+    types = sorted(tag[2:] for tag in index.tags if tag.startswith("B-"))
+
+    counts = np.zeros((index.n_sentences, len(types)), dtype=np.int32)
+    for j, entity_type in enumerate(types):
+        counts[index.sentences("B-" + entity_type), j] = index.counts("B-" + entity_type)
+
+    return counts, types
+
+
+class IterativeStratifiedKFold:
+    """K-fold splitter that stratifies every entity type at once
+
+    Implements the iterative stratification of Sechidis et al. (2011) over
+    entity counts: entity types are processed from the rarest to the most
+    common, and each sentence with the current type goes to the fold that
+    still needs the most of it (ties: the fold that still needs the most
+    sentences, then random). Sentences without entities fill the folds up to
+    their sizes at the end. Each sentence is assigned once, so the cost is
+    linear in the number of non-zero counts, and all the K folds come out
+    balanced from the same pass.
+
+    Same interface as sklearn.model_selection.KFold:
+
+        counts, _ = entity_count_matrix(df)
+        skf = IterativeStratifiedKFold(n_splits=5, random_state=0)
+        for train_index, test_index in skf.split(df, counts):
+            ...
+
+    Args:
+        n_splits (int, optional): number of folds. Defaults to 5.
+        shuffle (bool, optional): random order of the sentences of each entity
+            type and of the sentences without entities. Defaults to True.
+        random_state (int, optional): seed of the shuffles and tie breaks.
+            Defaults to None.
+    """
+
+    def __init__(self, n_splits=5, shuffle=True, random_state=None):
+        assert n_splits >= 2, "n_splits must be at least 2"
+        self.n_splits = n_splits
+        self.shuffle = shuffle
+        self.random_state = random_state
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits
+
+    def split(self, X, y, groups=None):
+        """Yield the (train_index, test_index) positions of each fold
+
+        Args:
+            X: the samples, only used for its length
+            y (np.ndarray | scipy.sparse matrix): (n_samples, n_labels) matrix
+                with the count (or presence) of each label in each sample
+            groups (array-like, optional): group of each sample (eg. the
+                original sentence of each window). The samples of a group go
+                to the same fold, stratified on the summed counts of the
+                group. Defaults to None (each sample is its own group).
+        """
+        if groups is None:
+            folds = self.assign_folds(y)
+        else:
+            _, inverse = np.unique(np.asarray(groups), return_inverse=True)
+            indptr, labels, counts = _to_csr(y)
+            n_labels = int(labels.max()) + 1 if len(labels) else 0
+            group_counts = np.zeros((inverse.max() + 1 if len(inverse) else 0, n_labels))
+            rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+            np.add.at(group_counts, (inverse[rows], labels), counts)
+            folds = self.assign_folds(group_counts)[inverse]
+        assert len(folds) == len(X), "X and y have different lengths"
+
+        for k in range(self.n_splits):
+            yield np.flatnonzero(folds != k), np.flatnonzero(folds == k)
+
+    def assign_folds(self, y):
+        """Fold of each sample
+
+        Returns:
+            np.ndarray: int array with the fold (0..n_splits - 1) of each sample
+        """
+        rng = np.random.RandomState(self.random_state)
+        indptr, labels, counts = _to_csr(y)
+        n_samples = len(indptr) - 1
+        n_labels = int(labels.max()) + 1 if len(labels) else 0
+        K = self.n_splits
+
+        # DESIRED NUMBER OF SAMPLES AND OF EACH LABEL PER FOLD
+        total = np.bincount(labels, weights=counts, minlength=n_labels)
+        desired = [[t / K for t in total] for _ in range(K)]
+        desired_size = [n_samples / K] * K
+        remaining = total.tolist()
+
+        # SAMPLES OF EACH LABEL
+        sample_of_entry = np.repeat(np.arange(n_samples), np.diff(indptr))
+        order = np.argsort(labels, kind="stable")
+        label_bounds = np.searchsorted(labels[order], np.arange(n_labels + 1))
+
+        indptr_list = indptr.tolist()
+        labels_list = labels.tolist()
+        counts_list = counts.tolist()
+        folds = np.full(n_samples, -1, dtype=np.int64)
+        pending = set(range(n_labels))
+
+        while pending:
+            # THE RAREST LABEL STILL TO DISTRIBUTE
+            label = min(pending, key=lambda lab: (remaining[lab], lab))
+            pending.discard(label)
+
+            entries = order[label_bounds[label] : label_bounds[label + 1]]
+            samples = sample_of_entry[entries]
+            samples = samples[folds[samples] < 0]
+            if self.shuffle:
+                samples = rng.permutation(samples)
+
+            ties = rng.random_sample((len(samples), K)).tolist()
+            for sample, tie in zip(samples.tolist(), ties):
+                fold = max(
+                    range(K), key=lambda k: (desired[k][label], desired_size[k], tie[k])
+                )
+                folds[sample] = fold
+                desired_size[fold] -= 1
+                for entry in range(indptr_list[sample], indptr_list[sample + 1]):
+                    desired[fold][labels_list[entry]] -= counts_list[entry]
+                    remaining[labels_list[entry]] -= counts_list[entry]
+
+        # SAMPLES WITHOUT LABELS FILL THE FOLDS UP TO THEIR DESIRED SIZE
+        unassigned = np.flatnonzero(folds < 0)
+        if self.shuffle:
+            unassigned = rng.permutation(unassigned)
+        quota = _fill_quota(np.array(desired_size), len(unassigned))
+        folds[unassigned] = np.repeat(np.arange(K), quota)
+
+        return folds
+
+
+def split_groups(splitter, groups):
+    """Split with a sample splitter (eg. sklearn KFold) keeping groups together
+
+    The splitter splits the distinct groups (sorted), every sample goes to the
+    fold of its group. With one sample per group, in the order of the groups,
+    the folds are the ones of splitter.split(samples).
+
+        splits = split_groups(KFold(5, shuffle=True), corpus.index)
+
+    Args:
+        splitter: object with a split(X) method yielding train and test positions
+        groups (array-like): group of each sample
+
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: train and test positions of the samples
+    """
+    unique, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    for _, test in splitter.split(unique):
+        in_test = np.zeros(len(unique), dtype=bool)
+        in_test[test] = True
+        yield np.flatnonzero(~in_test[inverse]), np.flatnonzero(in_test[inverse])
+
+
+def _fill_quota(desired_size, n):
+    """Split n samples among the folds proportionally to their missing size"""
+    missing = np.clip(desired_size, 0, None)
+    if missing.sum() == 0:
+        missing = np.ones_like(missing)
+
+    quota = np.floor(missing / missing.sum() * n).astype(np.int64)
+    # THE REST GOES TO THE FOLDS WITH THE LARGEST FRACTIONAL PART
+    rest = n - quota.sum()
+    fraction = missing / missing.sum() * n - quota
+    quota[np.argsort(-fraction, kind="stable")[:rest]] += 1
+
+    return quota
+
+
+def _to_csr(y):
+    """(indptr, col indices, values) of the non-zero entries of y"""
+    if hasattr(y, "tocsr"):  # scipy.sparse
+        y = y.tocsr(copy=True)
+        y.sum_duplicates()
+        nonzero = y.data != 0
+        rows = np.repeat(np.arange(y.shape[0]), np.diff(y.indptr))[nonzero]
+        cols, values = y.indices[nonzero], y.data[nonzero]
+        n_rows = y.shape[0]
+    else:
+        y = np.asarray(y)
+        if y.ndim == 1:
+            y = y[:, None]
+        rows, cols = np.nonzero(y)
+        values = y[rows, cols]
+        n_rows = y.shape[0]
+
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+
+    return indptr, cols.astype(np.int64), values.astype(np.float64)
@@ -1,35 +1,178 @@
 import pandas as pd
+import bz2
+import contextlib
+import gzip
+import io
 import json
+import lzma
 import numpy as np
 import os
 import random
 
+try:
+    import orjson
+except ImportError:  # optional, only used by pandas2json(fast_json=True)
+    orjson = None
 
-def conll2pandas(path: str, sep=' '):
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed by pandas2parquet
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst files
+    zstandard = None
+
+# file extension of each supported compression
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+# characters written to disk at once by the pandas2* writers
+WRITE_BUFFER_SIZE = 1 << 20
+
+# last offset of an arrow list<> (int32 offsets), past it pandas2parquet
+# writes large_list<> (int64 offsets)
+PARQUET_MAX_LIST_OFFSET = (1 << 31) - 1
+
+
+def infer_compression(path: str):
+    """Compression of a file from its extension (eg. 'gzip' for .gz), or None"""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if str(path).endswith(extension):
+            return compression
+    return None
+
+
+@contextlib.contextmanager
+def open_text(path: str, mode='r', compression='infer', encoding='utf-8'):
+    """Open a text file, transparently (de)compressing it as a stream
+
+    The output is deterministic: gzip files are written without file name
+    nor timestamp in the header, so the same content always has the same hash.
+
+    Args:
+        path (str): filename (eg. train.conll.gz)
+        mode (str, optional): 'r' or 'w'. Defaults to 'r'.
+        compression (str, optional): 'gzip', 'bz2', 'xz', 'zstd', None for
+            plain text or 'infer' to detect it from the extension.
+            Defaults to 'infer'.
+        encoding (str, optional): text encoding. Defaults to 'utf-8'.
+
+    Yields:
+        io.TextIOBase: the text stream
+    """
+    assert mode in ('r', 'w'), "mode must be 'r' or 'w'"
+    if compression == 'infer':
+        compression = infer_compression(path)
+
+    with contextlib.ExitStack() as stack:
+        if compression is None:
+            yield stack.enter_context(open(path, mode, encoding=encoding))
+            return
+
+        if compression == 'gzip':
+            raw = stack.enter_context(open(path, mode + 'b'))
+            binary = gzip.GzipFile(
+                filename='', mode=mode + 'b', fileobj=raw, compresslevel=6, mtime=0
+            )
+        elif compression == 'bz2':
+            binary = bz2.open(path, mode + 'b')
+        elif compression == 'xz':
+            binary = lzma.open(path, mode + 'b')
+        elif compression == 'zstd':
+            assert zstandard is not None, 'zstd compression requires zstandard'
+            binary = zstandard.open(path, mode + 'b')
+        else:
+            raise ValueError(f'Unknown compression {compression}')
+
+        yield stack.enter_context(io.TextIOWrapper(binary, encoding=encoding))
+
+
+def iter_conll_sentences(path: str, sep=' ', columns=(0, -1), batch_size=None):
+    """Stream the sentences of a conll file, one line at a time
+
+    Only the sentence (or batch of sentences) being yielded is kept in memory,
+    so arbitrarily large files can be processed. The last sentence is yielded
+    even when the file does not end with a blank line. Compressed files
+    (.gz, .bz2, .xz, .zst) are decompressed on the fly.
+
+    Args:
+        path (str): filename (eg. dataset.conll or dataset.conll.gz)
+        sep (str, optional): column separator. Defaults to ' '.
+        columns (tuple, optional): column of each token to extract. An int picks
+            a single column, a slice picks a list of columns (eg. slice(1, None)
+            for all the tags). Defaults to (0, -1), the word and the last tag.
+        batch_size (int, optional): if set, yield lists of up to batch_size
+            sentences instead of one sentence at a time. Defaults to None.
+
+    Yields:
+        tuple: one list per column in `columns` (eg. (words, tags)), or a list of
+        those tuples when `batch_size` is set
+    """
+    if batch_size is None:
+        yield from _iter_conll_sentences(path, sep, columns)
+        return
+
+    assert batch_size > 0, 'batch_size must be positive'
+    batch = []
+    for sentence in _iter_conll_sentences(path, sep, columns):
+        batch.append(sentence)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_conll_sentences(path, sep, columns):
+    with open_text(path, 'r') as f:
+        yield from iter_conll_lines(f, sep, columns)
+
+
+def iter_conll_lines(lines, sep=' ', columns=(0, -1)):
+    """Group conll lines into sentences, see {iter_conll_sentences}
+
+    Args:
+        lines (Iterable[str]): lines of a conll file
+        sep (str, optional): column separator. Defaults to ' '.
+        columns (tuple, optional): column of each token to extract.
+            Defaults to (0, -1), the word and the last tag.
+
+    Yields:
+        tuple: one list per column in `columns` (eg. (words, tags))
+    """
+    sentence = tuple([] for _ in columns)
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            line_list = line.split(sep)
+            for values, column in zip(sentence, columns):
+                values.append(line_list[column])
+        elif sentence[0]:
+            yield sentence
+            sentence = tuple([] for _ in columns)
+    if sentence[0]:
+        yield sentence
+
+
+def conll2pandas(path: str, sep=' ', batch_size=10000):
     """Convert conll file to pandas dataframe
 
     Args:
         path (str): filename (eg. dataset.conll)
+        sep (str, optional): column separator. Defaults to ' '.
+        batch_size (int, optional): sentences read per chunk. Defaults to 10000.
 
     Returns:
         pandas.DataFrame: pandas DataFrame with text and tags cols
     """
-    with open(path, 'r', encoding='UTF8') as f:
-        texts = []
-        labels = []
-
-        words = []
-        tags = []
-        for line in f.readlines():
-            line_list = line.split(sep)
-            if line_list[0] != '\n':
-                words.append(line_list[0])
-                tags.append(line_list[-1][:-1])
-            else:
-                texts.append(words.copy())
-                labels.append(tags.copy())
-                words.clear()
-                tags.clear()
+    texts = []
+    labels = []
+    for batch in iter_conll_sentences(path, sep, batch_size=batch_size):
+        for words, tags in batch:
+            texts.append(words)
+            labels.append(tags)
 
     df = pd.DataFrame()
     df['text'] = texts
@@ -38,7 +181,7 @@ def conll2pandas(path: str, sep=' '):
     return df
 
 
-def conll2pandas_group_by_token(path: str, sep=' ', only_last=True):
+def conll2pandas_group_by_token(path: str, sep=' ', only_last=True, batch_size=10000):
     """Convert conll file to pandas dataframe.
 
     This function differs from {conll2pandas} by making
@@ -48,60 +191,162 @@ def conll2pandas_group_by_token(path: str, sep=' ', only_last=True):
         path (str): filename (eg. dataset.conll)
         only_last (boolean): if set to True, only the last tag (label)
             will be put in the tags column.
+        batch_size (int, optional): sentences read per chunk. Defaults to 10000.
     """
+    columns = (0, -1) if only_last else (0, slice(1, None))
 
-    with open(path, 'r', encoding='UTF8') as f:
-        texts = []
-        tags = []
-        for line in f.readlines():
-            line_list = line.replace('\n', '').replace('  ', ' ').split(sep)
-            tag = line_list[-1] if only_last else line_list[1:]
-
-            if line_list[0] != '':
-                texts.append(line_list[0])
-                tags.append(tag)
+    texts = []
+    tags = []
+    for batch in iter_conll_sentences(path, sep, columns, batch_size=batch_size):
+        for words, labels in batch:
+            texts.extend(words)
+            tags.extend(labels)
 
     return pd.DataFrame({'text': texts, 'tags': tags})
 
 
-def pandas2conll(df, fname):
+def pandas2conll(df, fname, buffer_size=WRITE_BUFFER_SIZE, compression='infer'):
     """Convert pandas Dataframe to conll file
 
+    Sentences are streamed to the file in blocks of about `buffer_size`
+    characters, the output is byte-identical to writing one
+    'word O O tag' line per token and a blank line after each sentence.
+
     Args:
-        df (pd.DataFrame): pandas DataFrame with cols text and tags
+        df (pd.DataFrame | Corpus): pandas DataFrame with cols text and tags
         fname (str): filename to save eg. dataset.conll
+        buffer_size (int, optional): characters written per block.
+            Defaults to 1M.
+        compression (str, optional): see {open_text}, by default inferred
+            from the fname extension (eg. dataset.conll.gz).
     """
-    rows = []
+    def conll_blocks():
+        for text, ent in _iter_text_tags(df):
+            yield ''.join(
+                [str(word)+' O O '+str(tag)+'\n' for word, tag in zip(text, ent)]
+            )
+            yield '\n'
 
-    for text, ent in zip(df['text'], df['tags']):
-        for word, tag in zip(text, ent):
-            rows.append(str(word)+' O O '+str(tag)+'\n')
-        rows.append('\n')
+    with open_text(fname, 'w', compression) as f:
+        _write_buffered(f, conll_blocks(), buffer_size)
 
-    with open(fname, 'w', encoding="utf-8") as f:
-        f.writelines(rows)
 
-
-def pandas2json(df, fname: str):
+def pandas2json(
+    df, fname: str, buffer_size=WRITE_BUFFER_SIZE, fast_json=False, compression='infer'
+):
     """Convert pandas to json file
 
+    One {"text": [...], "tags": [...]} object per line, streamed to the file
+    in blocks of about `buffer_size` characters. By default the output is
+    byte-identical to `json.dump(..., ensure_ascii=False)` of each row.
+
     Args:
-        df (pd.DataFrame): Dataframe Object
+        df (pd.DataFrame | Corpus): Dataframe Object
         fname (str): file name
+        buffer_size (int, optional): characters written per block.
+            Defaults to 1M.
+        fast_json (bool, optional): encode with orjson when it is installed.
+            Faster, but orjson writes compact json (no space after ',' and ':'),
+            so the output is NOT byte-identical. Defaults to False.
+        compression (str, optional): see {open_text}, by default inferred
+            from the fname extension (eg. train.json.gz).
     """
+    if fast_json and orjson is not None:
+        def json_lines():
+            for text, tags in _iter_text_tags(df):
+                yield orjson.dumps({'text': text, 'tags': tags}).decode('utf-8') + '\n'
+    else:
+        encode = json.JSONEncoder(ensure_ascii=False).encode
 
-    texts = []
-    for i in range(len(df)):
-        text_dict = {
-            "text": df['text'].iloc[i],
-            "tags": df['tags'].iloc[i]
-        }
-        texts.append(text_dict)
-
-    with open(fname, 'w', encoding='utf8') as file:
-        for text in texts:
-            json.dump(text, file, ensure_ascii=False)
-            file.write('\n')
+        def json_lines():
+            for text, tags in _iter_text_tags(df):
+                yield '{"text": ' + encode(text) + ', "tags": ' + encode(tags) + '}\n'
+
+    with open_text(fname, 'w', compression) as file:
+        _write_buffered(file, json_lines(), buffer_size)
+
+
+def pandas2parquet(
+    df, fname: str, row_group_size=10000, tag_names=None, compression='snappy'
+):
+    """Convert pandas to a parquet file (requires pyarrow)
+
+    Each row is a sentence with a 'text' col of type list<string> and a 'tags'
+    col of type list<string>, or list<int32> when `tag_names` is given, plus a
+    'source_file' string col when the sentences have one (sharded input). The
+    tag id -> tag name vocabulary is then stored as json in the 'tag_names'
+    key of the schema metadata. Rows are split into row groups of
+    `row_group_size` sentences so readers can stream the file. With 2^31
+    tokens or more the list cols are large_list<> (int64 offsets), and the
+    strings large_string.
+
+    Args:
+        df (pd.DataFrame | Corpus): Dataframe Object
+        fname (str): file name (eg. train.parquet)
+        row_group_size (int, optional): sentences per row group. Defaults to 10000.
+        tag_names (List[str], optional): vocabulary to write the tags as ids,
+            use the same one for every fold. Defaults to None (tags as strings).
+        compression (str, optional): parquet codec. Defaults to 'snappy'.
+    """
+    assert pa is not None, 'pandas2parquet requires pyarrow'
+    from src.corpus import Corpus
+
+    corpus = df if isinstance(df, Corpus) else Corpus.from_pandas(df)
+    if corpus.offsets[-1] <= PARQUET_MAX_LIST_OFFSET:
+        list_array, string, offsets_type = pa.ListArray, pa.string(), pa.int32()
+    else:
+        # 2^31 TOKENS OR MORE OVERFLOW THE int32 OFFSETS
+        list_array, string, offsets_type = (
+            pa.LargeListArray, pa.large_string(), pa.int64()
+        )
+    offsets = pa.array(corpus.offsets, type=offsets_type)
+    text = list_array.from_arrays(offsets, pa.array(corpus.tokens, type=string))
+
+    metadata = {}
+    if tag_names is None:
+        values = pa.array(corpus.tags, type=string)
+    else:
+        tag_index = {tag: i for i, tag in enumerate(tag_names)}
+        missing = set(corpus.tag_names) - set(tag_index)
+        assert not missing, f'Tags not in tag_names: {sorted(missing)}'
+        lookup = np.array([tag_index[tag] for tag in corpus.tag_names], dtype=np.int32)
+        values = pa.array(lookup[corpus.tag_ids], type=pa.int32())
+        metadata[b'tag_names'] = json.dumps(list(tag_names), ensure_ascii=False)
+
+    columns = [text, list_array.from_arrays(offsets, values)]
+    names = ['text', 'tags']
+    if corpus.source_file is not None:
+        columns.append(pa.array(corpus.source_file, type=pa.string()))
+        names.append('source_file')
+
+    table = pa.Table.from_arrays(columns, names=names).replace_schema_metadata(metadata)
+
+    pq.write_table(
+        table, fname, row_group_size=row_group_size, compression=compression
+    )
+
+
+def _iter_text_tags(df):
+    """(text, tags) of each sentence of a DataFrame or a Corpus"""
+    if isinstance(df, pd.DataFrame):
+        return zip(df['text'].tolist(), df['tags'].tolist())
+
+    return df.iter_sentences()
+
+
+def _write_buffered(f, chunks, buffer_size):
+    assert buffer_size > 0, 'buffer_size must be positive'
+
+    block = []
+    size = 0
+    for chunk in chunks:
+        block.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            f.write(''.join(block))
+            block.clear()
+            size = 0
+    f.write(''.join(block))
 
 
 def fix_seed(random_state):
@@ -0,0 +1,91 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import balanceamento
+
+ENTITIES = [tag[2:] for tag in balanceamento.redator + balanceamento.auxiliar]
+
+
+def make_split(seed, n_sentences=300, train_size=0.8):
+    """Random train/test sentences; the entities are skewed to one side, so that
+    the balancing has to move sentences both ways"""
+    rng = np.random.RandomState(seed)
+    skew = rng.uniform(0.3, 1.0, len(ENTITIES))
+    texts, tags, in_train = [], [], []
+    for i in range(n_sentences):
+        length = int(rng.randint(3, 20))
+        sentence = ["O"] * length
+        side = rng.rand() < train_size
+        for _ in range(int(rng.randint(0, 3))):
+            entity = int(rng.randint(len(ENTITIES)))
+            if (rng.rand() < skew[entity]) != side:
+                continue
+            start = int(rng.randint(length - 1))
+            name = ENTITIES[entity]
+            sentence[start : start + 2] = ["B-" + name, "I-" + name]
+        texts.append([f"w{i}_{j}" for j in range(length)])
+        tags.append(sentence)
+        in_train.append(side)
+
+    df = pd.DataFrame({"text": texts, "tags": tags}, index=rng.permutation(n_sentences))
+    in_train = np.array(in_train)
+    return df[in_train], df[~in_train]
+
+
+def reference_balance(train_dataframe, test_dataframe):
+    """Row by row balancing: for each entity, the first sentences (in the current
+    order of the source) containing it are moved, one at a time, to the end of
+    the other dataset"""
+    split_percents = getattr(balanceamento, "__split_percents")
+    get_balancing_samples = getattr(balanceamento, "__get_balancing_samples")
+
+    train = list(zip(train_dataframe.index, train_dataframe["tags"]))
+    test = list(zip(test_dataframe.index, test_dataframe["tags"]))
+
+    def count(rows, entity):
+        return sum(tags.count(entity) for _, tags in rows)
+
+    for entities in (balanceamento.redator, balanceamento.auxiliar):
+        corrections = get_balancing_samples(
+            *split_percents(
+                [count(train, entity) for entity in entities],
+                [count(test, entity) for entity in entities],
+            )
+        )
+        for correction, entity in zip(corrections, entities):
+            source, destination = (train, test) if correction > 0 else (test, train)
+            moved = [row for row in source if entity in row[1]][: abs(correction)]
+            for row in moved:
+                source.remove(row)
+                destination.append(row)
+
+    return [index for index, _ in train], [index for index, _ in test]
+
+
+def entity_counts(dataframe):
+    return Counter(tag for tags in dataframe["tags"] for tag in tags if tag != "O")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_balance_from_dataframe_matches_row_by_row_reference(seed):
+    train, test = make_split(seed)
+    expected_train, expected_test = reference_balance(train, test)
+
+    balanced_train, balanced_test = balanceamento.balance_from_dataframe(train, test)
+
+    assert list(balanced_train.index) == expected_train
+    assert list(balanced_test.index) == expected_test
+    assert entity_counts(balanced_train) == entity_counts(
+        pd.concat([train, test]).loc[expected_train]
+    )
+    assert entity_counts(balanced_test) == entity_counts(
+        pd.concat([train, test]).loc[expected_test]
+    )
+    # NO SENTENCE IN BOTH DATASETS, AND EVERY SENTENCE IN ONE OF THEM
+    assert not set(balanced_train.index) & set(balanced_test.index)
+    assert sorted(balanced_train.index.append(balanced_test.index)) == sorted(
+        train.index.append(test.index)
+    )
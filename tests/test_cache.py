@@ -0,0 +1,176 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.cache import ParseCache, StepCache, load_conll
+from src.corpus import Corpus
+from src.dataset_preprocessing import PreprocessingPipeline
+
+
+def make_corpus(n_sentences=200, seed=0):
+    rng = np.random.RandomState(seed)
+    texts, tags = [], []
+    for i in range(n_sentences):
+        length = int(rng.randint(1, 20))
+        entity = ["Valores", "Normativo", "Datas"][int(rng.randint(3))]
+        sentence = ["O"] * length
+        if rng.rand() > 0.4:
+            sentence[int(rng.randint(length))] = "B-" + entity
+        texts.append([f"w{i}_{j}" for j in range(length)])
+        tags.append(sentence)
+
+    return Corpus.from_pandas(pd.DataFrame({"text": texts, "tags": tags}))
+
+
+def assert_same_corpus(result, expected):
+    np.testing.assert_array_equal(result.tokens, expected.tokens)
+    np.testing.assert_array_equal(result.tag_ids, expected.tag_ids)
+    np.testing.assert_array_equal(result.offsets, expected.offsets)
+    np.testing.assert_array_equal(result.tag_names, expected.tag_names)
+    np.testing.assert_array_equal(result.index, expected.index)
+
+
+def write_conll(path, corpus):
+    with open(path, "w", encoding="utf-8") as f:
+        for text, tags in zip(corpus.to_pandas()["text"], corpus.to_pandas()["tags"]):
+            f.writelines(f"{word} {tag}\n" for word, tag in zip(text, tags))
+            f.write("\n")
+
+
+def cache_entries(cache_dir):
+    return sorted(
+        name for name in os.listdir(cache_dir) if os.path.isdir(cache_dir / name)
+    )
+
+
+def pipeline(**kwargs):
+    config = {
+        "max_length_sentence": 8,
+        "undersampling_negative_sentences": True,
+        "undersampling_tags": ["Normativo"],
+        "ratio_of_undersample_tags": 0.5,
+    }
+    config.update(kwargs)
+    return PreprocessingPipeline(**config)
+
+
+def test_step_cache_warm_run_equals_cold_run(tmp_path, capsys):
+    cache = StepCache(str(tmp_path))
+    expected = pipeline().run(make_corpus())
+
+    cold = pipeline().run(make_corpus(), cache=cache)
+    assert "loaded from cache" not in capsys.readouterr().out
+    warm = pipeline().run(make_corpus(), cache=cache)
+    assert "stage undersampling loaded from cache" in capsys.readouterr().out
+
+    assert_same_corpus(cold, expected)
+    assert_same_corpus(warm, expected)
+
+
+def test_step_cache_resumes_after_the_last_unchanged_stage(tmp_path, capsys):
+    cache = StepCache(str(tmp_path))
+    pipeline().run(make_corpus(), cache=cache)
+    capsys.readouterr()
+
+    result = pipeline(ratio_of_undersample_tags=0.2).run(make_corpus(), cache=cache)
+    assert "stage max_length loaded from cache" in capsys.readouterr().out
+    assert_same_corpus(result, pipeline(ratio_of_undersample_tags=0.2).run(make_corpus()))
+
+    # THE STRIDE ONLY MATTERS TO THE WINDOWS
+    pipeline(window_stride=3).run(make_corpus(), cache=cache)
+    assert "stage undersampling loaded from cache" in capsys.readouterr().out
+    pipeline(long_sentence_mode="window", window_stride=3).run(make_corpus(), cache=cache)
+    # THE UNCHANGED jurisprudencia STAGE IS NOT STORED
+    assert "stage tags loaded from cache" in capsys.readouterr().out
+
+
+def test_step_cache_does_not_store_unchanged_stages(tmp_path):
+    cache = StepCache(str(tmp_path))
+    pipeline().run(make_corpus(), cache=cache)
+
+    stored = sorted(name.split("-")[0] for name in os.listdir(tmp_path))
+    assert stored == ["max_length", "tags", "undersampling"]
+
+
+def test_step_cache_evicts_the_oldest_entries(tmp_path):
+    corpus = make_corpus()
+    cache = StepCache(str(tmp_path))
+    cache.put("a", corpus)
+    entry_size = sum(
+        os.path.getsize(os.path.join(tmp_path, "a", name))
+        for name in os.listdir(os.path.join(tmp_path, "a"))
+    )
+    # ROOM FOR TWO ENTRIES
+    cache = StepCache(str(tmp_path), max_size_mb=2.5 * entry_size / 1024 / 1024)
+    cache.put("b", corpus)
+    os.utime(os.path.join(tmp_path, "a"), (1, 1))
+    os.utime(os.path.join(tmp_path, "b"), (2, 2))
+
+    cache.put("c", corpus)
+
+    assert cache.get("a") is None
+    assert_same_corpus(cache.get("b"), corpus)
+    assert_same_corpus(cache.get("c"), corpus)
+
+
+def test_parse_cache_hit_equals_a_fresh_parse(tmp_path):
+    path = tmp_path / "dataset.conll"
+    write_conll(path, make_corpus())
+    cache_dir = tmp_path / "cache"
+
+    miss = load_conll(str(path), cache_dir=str(cache_dir))
+    assert len(cache_entries(cache_dir)) == 1
+    hit = load_conll(str(path), cache_dir=str(cache_dir))
+
+    expected = Corpus.from_conll(str(path))
+    assert_same_corpus(miss, expected)
+    assert_same_corpus(hit, expected)
+    assert len(cache_entries(cache_dir)) == 1
+
+
+def test_parse_cache_entry_is_invalidated_by_an_edit(tmp_path):
+    path = tmp_path / "dataset.conll"
+    write_conll(path, make_corpus(seed=0))
+    cache = ParseCache(str(tmp_path / "cache"))
+    key = cache.key(str(path))
+    cache.load(str(path))
+
+    write_conll(path, make_corpus(seed=1))
+    os.utime(path, ns=(1, 1))  # A NEW MTIME EVEN ON A COARSE CLOCK
+
+    assert cache.key(str(path)) != key
+    assert_same_corpus(cache.load(str(path)), Corpus.from_conll(str(path)))
+    assert len(cache_entries(tmp_path / "cache")) == 2
+
+
+def test_parse_cache_evicts_down_to_max_size(tmp_path):
+    paths = []
+    for seed in range(4):
+        paths.append(str(tmp_path / f"dataset{seed}.conll"))
+        write_conll(paths[-1], make_corpus(seed=seed))
+    cache_dir = tmp_path / "cache"
+    cache = ParseCache(str(cache_dir))
+    cache.load(paths[0], evict=False)
+    entry = cache_dir / cache_entries(cache_dir)[0]
+    entry_size = sum(os.path.getsize(entry / name) for name in os.listdir(entry))
+
+    # ROOM FOR ABOUT TWO ENTRIES
+    max_size = 2.5 * entry_size
+    cache = ParseCache(str(cache_dir), max_size_mb=max_size / 1024 / 1024)
+    keys = [cache.key(path) for path in paths]
+    for i, path in enumerate(paths[1:], start=1):
+        # THE ENTRIES GET OLDER IN THE ORDER THEY WERE LOADED
+        for mtime, key in enumerate(keys[:i], start=1):
+            if os.path.exists(cache_dir / key):
+                os.utime(cache_dir / key, (mtime, mtime))
+        cache.load(path)
+
+    sizes = [
+        sum(os.path.getsize(cache_dir / name / f) for f in os.listdir(cache_dir / name))
+        for name in cache_entries(cache_dir)
+    ]
+    assert len(sizes) == 2
+    assert sum(sizes) <= max_size
+    # THE LAST TWO LOADED ARE KEPT
+    assert cache_entries(cache_dir) == sorted(keys[2:])
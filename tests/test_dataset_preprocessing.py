@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+from src import dataset_preprocessing as preprocessing
+
+ENTITIES = [
+    "CPF",
+    "Valores",
+    "Normativo",
+    "Jurisprudência",
+    "Data_do_contrato",
+    "Data_dos_fatos",
+    "Datas",
+]
+
+
+def make_dataset(n_sentences=400, seed=0):
+    """Sentences of 1 to 30 tokens, about a third of them negative"""
+    rng = np.random.RandomState(seed)
+    texts, tags = [], []
+    for i in range(n_sentences):
+        length = int(rng.randint(1, 30))
+        sentence = ["O"] * length
+        if rng.rand() > 0.35:
+            for _ in range(int(rng.randint(1, 4))):
+                start = int(rng.randint(length))
+                size = min(int(rng.randint(1, 4)), length - start)
+                entity = ENTITIES[int(rng.randint(len(ENTITIES)))]
+                sentence[start : start + size] = ["B-" + entity] + ["I-" + entity] * (
+                    size - 1
+                )
+        texts.append([f"w{i}_{j}" for j in range(length)])
+        tags.append(sentence)
+
+    return pd.DataFrame({"text": texts, "tags": tags})
+
+
+def run_steps(df, config):
+    """The PREPROCESSING steps of main.py, one function at a time"""
+    if config.get("fill_O_tags", ""):
+        df = preprocessing.fill_O_tags(df, config["fill_O_tags"])
+    if config.get("datas_aggregation"):
+        df = preprocessing.datas_change(df, datas_to_change=config["datas_aggregation"])
+    if config.get("remove_jurisprudencia_sentence", False):
+        df = preprocessing.remove_jurisprudencia_sentence(df)
+    df = preprocessing.trucate_sentence_max_length(
+        df, max_length=config.get("max_length_sentence", 256)
+    )
+    if config.get("undersampling_negative_sentences"):
+        df = preprocessing.undersampling_negative_sentences(
+            df,
+            ratio_to_remove=config.get("ratio_of_undersample_negative_sentences", 0.8),
+        )
+    if config.get("undersampling_tags"):
+        df = preprocessing.undersampling_entity(
+            df,
+            undersampling_tags=config["undersampling_tags"],
+            ratio_to_remove=config.get("ratio_of_undersample_tags", 0.5),
+        )
+    return df
+
+
+@pytest.mark.parametrize("remove_jurisprudencia", [False, True])
+@pytest.mark.parametrize("undersampling", [False, True])
+def test_pipeline_matches_the_step_functions(remove_jurisprudencia, undersampling):
+    config = OmegaConf.create(
+        {
+            "max_length_sentence": 12,
+            "fill_O_tags": ["CPF"],
+            "datas_aggregation": ["Data_do_contrato", "Data_dos_fatos"],
+            "remove_jurisprudencia_sentence": remove_jurisprudencia,
+            "undersampling_negative_sentences": undersampling,
+            "ratio_of_undersample_negative_sentences": 0.8,
+            "undersampling_tags": ["Normativo"] if undersampling else "",
+            "ratio_of_undersample_tags": 0.5,
+        }
+    )
+    df = make_dataset()
+
+    expected = run_steps(df.copy(), config)
+    corpus = preprocessing.PreprocessingPipeline.from_config(config).run(df.copy())
+    result = corpus.to_pandas()
+
+    assert len(result) < len(df) or not (remove_jurisprudencia or undersampling)
+    assert list(result["text"]) == list(expected["text"])
+    assert list(result["tags"]) == list(expected["tags"])
+    # THE INDEX OF THE KEPT SENTENCES IN THE INPUT
+    for i, text in zip(corpus.index, result["text"]):
+        assert df["text"][i][: len(text)] == text
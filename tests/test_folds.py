@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+from src import folds
+from src.dataset_preprocessing import PreprocessingPipeline
+
+ENTITIES = ["Valor_dano_moral", "Data_do_contrato", "CPF_do_réu", "Valores", "CPF"]
+
+
+def make_dataset(n_sentences=120, seed=0):
+    """Sentences of 2 to 40 tokens with a few entities of 1 to 3 tokens"""
+    rng = np.random.RandomState(seed)
+    texts, tags = [], []
+    for i in range(n_sentences):
+        length = int(rng.randint(2, 40))
+        sentence = ["O"] * length
+        for _ in range(int(rng.randint(0, 4))):
+            start = int(rng.randint(0, length))
+            size = min(int(rng.randint(1, 4)), length - start)
+            entity = ENTITIES[int(rng.randint(len(ENTITIES)))]
+            sentence[start : start + size] = ["B-" + entity] + ["I-" + entity] * (
+                size - 1
+            )
+        texts.append([f"w{i}_{j}" for j in range(length)])
+        tags.append(sentence)
+
+    return pd.DataFrame({"text": texts, "tags": tags})
+
+
+def windowed_dataset():
+    """Preprocessed like main.py: the long sentences split in overlapping windows"""
+    pipeline = PreprocessingPipeline(max_length_sentence=8, long_sentence_mode="window")
+    corpus = pipeline.run(make_dataset())
+    return corpus.to_pandas().reset_index(drop=True), np.asarray(corpus.index)
+
+
+@pytest.mark.parametrize("strategy", ["kfold", "stratified"])
+def test_split_folds_keeps_windows_of_a_sentence_together(strategy):
+    df, groups = windowed_dataset()
+    assert len(np.unique(groups)) < len(df), "no sentence was windowed"
+
+    splits = folds.split_folds(df, groups=groups, n_splits=5, strategy=strategy)
+
+    dev_folds = np.zeros(len(df), dtype=int)
+    for train_index, test_index in splits:
+        assert not set(groups[train_index]) & set(groups[test_index])
+        assert len(train_index) + len(test_index) == len(df)
+        dev_folds[test_index] += 1
+    # EVERY ROW IN THE DEV OF EXACTLY ONE FOLD
+    assert (dev_folds == 1).all()
+
+
+def test_split_folds_without_groups_is_kfold():
+    from sklearn.model_selection import KFold
+
+    df = make_dataset()
+    splits = folds.split_folds(df, n_splits=5, random_state=3)
+    expected = KFold(n_splits=5, shuffle=True, random_state=3).split(df)
+
+    for (train, test), (train_kf, test_kf) in zip(splits, expected):
+        np.testing.assert_array_equal(train, train_kf)
+        np.testing.assert_array_equal(test, test_kf)
+
+
+@pytest.mark.parametrize("strategy", ["greedy", "global"])
+def test_balanced_fold_keeps_windows_of_a_sentence_together(tmp_path, strategy):
+    df, groups = windowed_dataset()
+    train_index, test_index = folds.split_folds(df, groups=groups, n_splits=5)[0]
+    config = OmegaConf.create(
+        {
+            "UTILS": {"random_state": 0},
+            "PREPROCESSING": {"balance_folds": True},
+            "BALANCING": {"strategy": strategy},
+            "SAVE": {"index_only": True},
+        }
+    )
+
+    folds.process_fold(
+        0,
+        df.loc[train_index],
+        df.loc[test_index],
+        str(tmp_path),
+        config,
+        groups=groups,
+    )
+
+    train = np.load(os.path.join(tmp_path, "fold-0", "train.idx.npy"))
+    dev = np.load(os.path.join(tmp_path, "fold-0", "dev.idx.npy"))
+    assert not set(groups[train]) & set(groups[dev])
+    assert sorted(np.concatenate([train, dev]).tolist()) == list(range(len(df)))
+
+
+def fold_files(save_folder):
+    """Relative path -> bytes of every file written for the folds"""
+    files = {}
+    for root, _, names in os.walk(save_folder):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, save_folder)] = f.read()
+    return files
+
+
+@pytest.mark.parametrize(
+    "save, strategy",
+    [
+        ({"save_into_parquet": True}, "greedy"),
+        ({"compression": "gzip"}, "global"),
+        ({"index_only": True}, "greedy"),
+    ],
+)
+def test_parallel_folds_equal_serial_folds(tmp_path, save, strategy):
+    df, groups = windowed_dataset()
+    splits = folds.split_folds(df, groups=groups, n_splits=3)
+    config = OmegaConf.create(
+        {
+            "UTILS": {"random_state": 0},
+            "PREPROCESSING": {"balance_folds": True},
+            "BALANCING": {"strategy": strategy},
+            "SAVE": save,
+        }
+    )
+
+    outputs = []
+    for n_jobs in (1, 2):
+        save_folder = str(tmp_path / f"jobs-{n_jobs}")
+        os.makedirs(save_folder)
+        if save.get("index_only"):
+            folds.save_corpus(df, save_folder)
+        folds.run_folds(df, splits, save_folder, config, n_jobs=n_jobs, groups=groups)
+        outputs.append(fold_files(save_folder))
+
+    serial, parallel = outputs
+    assert sorted(serial) == sorted(parallel)
+    assert any(path.startswith("fold-2") for path in serial)
+    for path in serial:
+        assert parallel[path] == serial[path], path
+
+
+@pytest.mark.parametrize("option", [{"save_into_parquet": True}, {"compression": "gzip"}])
+def test_index_only_rejects_the_options_it_ignores(tmp_path, option):
+    df = make_dataset()
+    save = OmegaConf.create({"index_only": True, **option})
+
+    with pytest.raises(AssertionError, match="index_only"):
+        folds.save_fold(df[:100], df[100:], str(tmp_path) + "/", save)
+    assert not os.listdir(tmp_path)
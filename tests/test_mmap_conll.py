@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import utils
+from src.mmap_conll import MmapConll
+
+# LEADING, REPEATED AND TRAILING BLANK LINES, 4 COLUMNS AND NON ASCII WORDS
+CONLL = (
+    "\n\n"
+    "O O O O\nréu O O B-Pessoa\npagará O O O\n"
+    "\n"
+    "R$ O O B-Valores\n1.000,00 O O I-Valores\n"
+    "\n \n\n"
+    "único O O O\n"
+    "\n"
+    "Art. O O B-Normativo\n5º O O I-Normativo\n"
+    "\n\n"
+)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "dataset.conll"
+    path.write_text(CONLL, encoding="utf-8")
+    return str(path)
+
+
+def test_sentences_equal_conll2pandas(path):
+    expected = utils.conll2pandas(path)
+
+    with MmapConll(path) as conll:
+        assert len(conll) == len(expected) == 4
+        for i in range(len(conll)):
+            assert conll[i] == (expected["text"][i], expected["tags"][i])
+        assert conll[-1] == conll[3]
+        assert conll[1:4] == [conll[i] for i in range(1, 4)]
+        assert conll[::2] == [conll[0], conll[2]]
+        with pytest.raises(IndexError):
+            conll[4]
+
+        pd.testing.assert_frame_equal(conll.to_pandas(), expected)
+        subset = conll.to_pandas([3, 1])
+        assert list(subset.index) == [3, 1]
+        assert list(subset["text"]) == [expected["text"][3], expected["text"][1]]
+        assert list(subset["tags"]) == [expected["tags"][3], expected["tags"][1]]
+
+
+def test_persisted_index_is_reused(path, monkeypatch):
+    with MmapConll(path) as conll:
+        expected = conll.to_pandas()
+    assert os.path.exists(path + ".sentidx.npz")
+
+    def scan(self):
+        raise AssertionError("the file was scanned again")
+
+    monkeypatch.setattr(MmapConll, "_scan", scan)
+    with MmapConll(path) as conll:
+        pd.testing.assert_frame_equal(conll.to_pandas(), expected)
+
+
+def test_index_is_rebuilt_after_the_file_changes(path):
+    with MmapConll(path) as conll:
+        assert len(conll) == 4
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("novo O O B-Pessoa\n")
+    os.utime(path, ns=(1, 1))  # A NEW MTIME EVEN ON A COARSE CLOCK
+
+    with MmapConll(path) as conll:
+        assert len(conll) == 5
+        assert conll[4] == (["novo"], ["B-Pessoa"])
+        pd.testing.assert_frame_equal(conll.to_pandas(), utils.conll2pandas(path))
+    with np.load(path + ".sentidx.npz") as index:
+        assert index["signature"].tolist() == [os.path.getsize(path), 1]
+
+
+def test_index_persistence_can_be_disabled(path):
+    with MmapConll(path, index_path=False) as conll:
+        assert len(conll) == 4
+    assert not os.path.exists(path + ".sentidx.npz")
+
+
+def test_empty_and_compressed_files(tmp_path):
+    empty = tmp_path / "empty.conll"
+    empty.write_text("")
+    with MmapConll(str(empty)) as conll:
+        assert len(conll) == 0
+
+    with pytest.raises(ValueError):
+        MmapConll(str(tmp_path / "dataset.conll.gz"))
@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from src.sketches import CountMinSketch, HyperLogLog, KLLSketch, ReservoirSample
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_kll_quantiles_within_rank_error(seed):
+    values = np.random.RandomState(seed).lognormal(3, 1, 100000)
+    sketch = KLLSketch(k=200, seed=seed)
+    # IN BATCHES, PLUS A MERGED SKETCH, LIKE THE STREAMING ANALYSIS
+    for batch in np.array_split(values[:60000], 7):
+        sketch.update(batch)
+    sketch.merge(KLLSketch(k=200, seed=seed + 1).update(values[60000:]))
+
+    assert sketch.n == len(values)
+    ordered = np.sort(values)
+    for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+        rank = np.searchsorted(ordered, sketch.quantile(q)) / len(values)
+        assert abs(rank - q) <= sketch.rank_error
+
+
+def test_kll_small_stream_is_exact():
+    sketch = KLLSketch(k=200).update([5, 1, 3, 2, 4])
+    assert [sketch.quantile(q) for q in (0, 0.5, 1)] == [1, 3, 5]
+    assert KLLSketch().quantile(0.5) is None
+
+
+@pytest.mark.parametrize("n_distinct", [100, 5000, 200000])
+def test_hll_count_within_relative_error(n_distinct):
+    values = [f"token{i}" for i in range(n_distinct)]
+    hll = HyperLogLog(p=12).update(values[: n_distinct // 2])
+    # REPEATED VALUES DO NOT COUNT TWICE
+    hll.merge(HyperLogLog(p=12).update(values[n_distinct // 3 :]))
+
+    # 3 STANDARD ERRORS
+    assert abs(hll.count() - n_distinct) <= 3 * hll.relative_error * n_distinct
+
+
+def test_count_min_never_undercounts_and_overcounts_within_error():
+    rng = np.random.RandomState(0)
+    counts = {f"tag{i}": int(c) for i, c in enumerate(rng.zipf(1.5, 3000))}
+    sketch = CountMinSketch(width=512, depth=5)
+    items = list(counts.items())
+    sketch.update(dict(items[:1000])).merge(
+        CountMinSketch(width=512, depth=5).update(dict(items[1000:]))
+    )
+
+    assert sketch.total == sum(counts.values())
+    errors = np.array([sketch.estimate(tag) - count for tag, count in items])
+    assert (errors >= 0).all()
+    # EACH ESTIMATE IS WITHIN THE ERROR WITH PROBABILITY `confidence`
+    assert np.mean(errors <= sketch.error) >= sketch.confidence
+
+
+def test_reservoir_sample_is_deterministic_per_seed():
+    def sample(seed):
+        reservoir = ReservoirSample(size=5, seed=seed)
+        for item in range(1000):
+            reservoir.add(item)
+        return reservoir
+
+    first, second = sample(7), sample(7)
+    assert first.items == second.items
+    assert first.seen == 1000
+    assert len(set(first.items)) == 5 and set(first.items) <= set(range(1000))
+    assert sample(8).items != first.items
+
+
+def test_reservoir_sample_keeps_every_item_of_a_short_stream():
+    reservoir = ReservoirSample(size=5)
+    for item in "abc":
+        reservoir.add(item)
+    assert reservoir.items == ["a", "b", "c"]
+
+
+def test_approx_analysis_does_not_depend_on_the_hash_seed(tmp_path):
+    rng = np.random.RandomState(0)
+    entities = ["CPF", "Valores", "Datas", "Valor_da_causa", "CNPJ", "Data_dos_fatos"]
+    path = tmp_path / "dataset.conll"
+    with open(path, "w", encoding="utf-8") as f:
+        # EVERY ENTITY IN THE FIRST SENTENCE, SO THEIR ORDER IS UP TO THE ANALYSIS
+        f.writelines(f"{entity} B-{entity}\n" for entity in entities)
+        f.write("\n")
+        for i in range(300):
+            for j in range(int(rng.randint(2, 12))):
+                entity = entities[int(rng.randint(len(entities)))]
+                tag = f"B-{entity}" if rng.rand() < 0.3 else "O"
+                f.write(f"w{i}_{j} {tag}\n")
+            f.write("\n")
+
+    def report(hash_seed):
+        return subprocess.run(
+            [sys.executable, "dataset_stats.py", str(path), "--approx", "--seed", "3"],
+            cwd=ROOT,
+            env={**os.environ, "PYTHONHASHSEED": str(hash_seed)},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    first = report(1)
+    assert "w" in first.split("Exemplos")[-1]
+    assert report(2) == first
+    assert report(3) == first
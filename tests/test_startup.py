@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+# SECONDS TO IMPORT main.py (~0.7s HERE, ABOUT 3X MARGIN FOR SLOWER MACHINES)
+IMPORT_BUDGET = 2.0
+
+HEAVY_MODULES = ["matplotlib", "seaborn", "sklearn"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "elapsed": elapsed,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def test_import_main_is_lazy_and_fast():
+    # A NEW INTERPRETER, SO THE MODULES IMPORTED BY OTHER TESTS DO NOT COUNT
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT % HEAVY_MODULES],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report["loaded"] == []
+    assert report["elapsed"] < IMPORT_BUDGET, (
+        f"importing main took {report['elapsed']:.2f}s (budget {IMPORT_BUDGET}s)"
+    )
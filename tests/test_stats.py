@@ -0,0 +1,124 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.stats import Stats, StatsAccumulator
+
+# FEW ENTITIES AND SHORT SENTENCES, SO MANY ENTITIES HAVE EQUAL COUNTS
+ENTITIES = ["Valores", "Datas", "CPF", "Normativo", "Pessoa", "Local"]
+
+
+def make_dataset(n_sentences=120, seed=0):
+    rng = np.random.RandomState(seed)
+    texts, tags = [], []
+    for i in range(n_sentences):
+        length = int(rng.randint(0, 12))
+        sentence = ["O"] * length
+        for _ in range(int(rng.randint(0, 3)) if length else 0):
+            start = int(rng.randint(length))
+            size = min(int(rng.randint(1, 4)), length - start)
+            entity = ENTITIES[int(rng.randint(len(ENTITIES)))]
+            # SOME MALFORMED SPANS (I- WITHOUT B-), SOME ENTITIES ONLY WITH I-
+            first = "I-" if rng.rand() < 0.1 or entity == "Local" else "B-"
+            sentence[start : start + size] = [first + entity] + ["I-" + entity] * (
+                size - 1
+            )
+        texts.append([f"w{i}_{j}" for j in range(length)])
+        tags.append(sentence)
+
+    # Rara_a APPEARS BEFORE Rara_b IN THE DATASET, BUT AFTER IT IN THE TRAIN (THE
+    # FIRST SENTENCE GOES TO DEV), WITH THE SAME COUNT
+    texts = [["x"], ["y"], ["z"]] + texts
+    tags = [["B-Rara_a"], ["B-Rara_b"], ["B-Rara_a"]] + tags
+
+    return pd.DataFrame({"text": texts, "tags": tags})
+
+
+def assert_identical(result, expected, path="stats"):
+    """Same values, types and key order, recursively"""
+    assert type(result) is type(expected), path
+    if isinstance(expected, dict):
+        assert list(result) == list(expected), path
+        for key in expected:
+            assert_identical(result[key], expected[key], f"{path}[{key!r}]")
+    elif isinstance(expected, float) and np.isnan(expected):
+        assert np.isnan(result), path
+    else:
+        assert result == expected, path
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_train_stats_from_full_minus_dev_equal_the_direct_stats(seed):
+    df = make_dataset(seed=seed)
+    rng = np.random.RandomState(seed)
+    in_dev = rng.rand(len(df)) < 0.2
+    in_dev[:3] = [True, False, False]
+    train, dev = df[~in_dev], df[in_dev]
+    # AFTER THE BALANCING THE TRAIN SENTENCES ARE NOT IN THE DATASET ORDER
+    if seed % 2:
+        train = train.iloc[rng.permutation(len(train))]
+
+    full = StatsAccumulator().update(df)
+    derived = full.copy().subtract(StatsAccumulator().update(dev)).order_as(train)
+
+    expected = Stats(train).get_stats()
+    labels = list(expected["Labels"].values())
+    assert len(labels) > len(set(labels)), "no entities with equal counts"
+    assert_identical(Stats(derived).get_stats(), expected)
+    # THE FULL STATS ARE NOT MODIFIED
+    assert_identical(Stats(full).get_stats(), Stats(df).get_stats())
+
+
+def test_merged_batches_equal_one_update():
+    df = make_dataset(seed=7)
+    merged = StatsAccumulator()
+    for batch in np.array_split(np.arange(len(df)), 4):
+        merged.merge(StatsAccumulator().update(df.iloc[batch]))
+
+    assert_identical(Stats(merged).get_stats(), Stats(df).get_stats())
+
+
+def reference_stats(df):
+    """get_stats of the DataFrame implementation the vectorized kernel replaced"""
+    quantidade_tokens = df["text"].map(len)
+    described = quantidade_tokens.describe()
+    len_null_sentences = df["tags"].map(lambda tags: all(t == "O" for t in tags)).sum()
+    tags = np.array([tag[2:] for tags in df["tags"] for tag in tags if tag[0] == "B"])
+    labels = dict(Counter(tags).most_common())
+    labels = {
+        k.replace("_", " "): v
+        for k, v in sorted(labels.items(), key=lambda item: item[1], reverse=True)
+    }
+
+    return {
+        "Quantidade de Sentenças": described["count"].astype(int),
+        "Quantidade de Sentenças Negativas": len_null_sentences,
+        "Quantidade de Sentenças acima de 256 tokens": (quantidade_tokens > 256).sum(),
+        "Quantidade de Sentenças acima de 512 tokens": (quantidade_tokens > 512).sum(),
+        "Quantidade de Tokens": quantidade_tokens.sum(),
+        "Tamanho da maior Sentença (tokens)": described["max"].astype(int),
+        "Tamanho médio das Sentenças": described["mean"].round(2),
+        "Quantidade de Entidades": len(tags),
+        "Quantidade de Classes": len(labels),
+        "Razão de Sentenças Negativas": len_null_sentences / described["count"],
+        "Labels": labels,
+        "Labels Ratio": {k: v / sum(labels.values()) for k, v in labels.items()},
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_vectorized_kernel_matches_the_dataframe_implementation(seed):
+    df = make_dataset(seed=seed)
+    # SENTENCES OVER THE LENGTH THRESHOLDS
+    df.loc[len(df)] = [["w"] * 300, ["O"] * 299 + ["B-Valores"]]
+    df.loc[len(df)] = [["w"] * 600, ["O"] * 600]
+
+    stats = Stats(df).get_stats()
+    expected = reference_stats(df)
+
+    # THE NEW KEYS (SPANS, CO-OCCURRENCE) GO AFTER THE SAME KEYS, IN THE SAME ORDER
+    assert [key for key in stats if key in expected] == list(expected)
+    for key, value in expected.items():
+        assert_identical(stats[key], value, key)
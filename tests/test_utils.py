@@ -0,0 +1,97 @@
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+from src import utils
+from src.corpus import Corpus
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "text": [
+                ["O", "réu", "pagará", "R$", "1.000,00"],
+                [],
+                ['"aspas"', "barra\\invertida", "tab\there", "emoji🙂", "ção"],
+                ["Art.", "5º"],
+            ],
+            "tags": [
+                ["O", "O", "O", "B-Valores", "I-Valores"],
+                [],
+                ["O", "O", "O", "O", "B-Normativo"],
+                ["B-Normativo", "I-Normativo"],
+            ],
+        }
+    )
+
+
+def reference_conll(df, fname):
+    """The line by line writer the buffered pandas2conll replaced"""
+    rows = []
+    for text, ent in zip(df["text"], df["tags"]):
+        for word, tag in zip(text, ent):
+            rows.append(str(word) + " O O " + str(tag) + "\n")
+        rows.append("\n")
+    with open(fname, "w", encoding="utf-8") as f:
+        f.writelines(rows)
+
+
+def reference_json(df, fname):
+    with open(fname, "w", encoding="utf8") as file:
+        for i in range(len(df)):
+            json.dump(
+                {"text": df["text"].iloc[i], "tags": df["tags"].iloc[i]},
+                file,
+                ensure_ascii=False,
+            )
+            file.write("\n")
+
+
+@pytest.mark.parametrize("buffer_size", [1, 7, 64, utils.WRITE_BUFFER_SIZE])
+@pytest.mark.parametrize("as_corpus", [False, True])
+@pytest.mark.parametrize(
+    "writer, reference, name",
+    [
+        (utils.pandas2conll, reference_conll, "train.conll"),
+        (utils.pandas2json, reference_json, "train.json"),
+    ],
+)
+def test_buffered_writers_are_byte_identical(
+    tmp_path, df, writer, reference, name, buffer_size, as_corpus
+):
+    reference(df, tmp_path / "expected")
+    data = Corpus.from_pandas(df) if as_corpus else df
+
+    writer(data, str(tmp_path / name), buffer_size=buffer_size)
+    writer(data, str(tmp_path / (name + ".gz")), buffer_size=buffer_size)
+
+    expected = (tmp_path / "expected").read_bytes()
+    assert (tmp_path / name).read_bytes() == expected
+    with gzip.open(tmp_path / (name + ".gz"), "rb") as f:
+        assert f.read() == expected
+
+
+TAG_NAMES = ["O", "B-Normativo", "I-Normativo", "B-Pessoa", "B-Valores", "I-Valores"]
+
+
+@pytest.mark.parametrize("tag_names", [None, TAG_NAMES])
+def test_parquet_switches_to_int64_offsets_past_int32(
+    tmp_path, df, monkeypatch, tag_names
+):
+    pq = pytest.importorskip("pyarrow.parquet")
+    pa = pytest.importorskip("pyarrow")
+    utils.pandas2parquet(df, str(tmp_path / "small.parquet"), tag_names=tag_names)
+    # AS IF THE FOLD HAD 2^31 TOKENS
+    monkeypatch.setattr(utils, "PARQUET_MAX_LIST_OFFSET", 5)
+    utils.pandas2parquet(df, str(tmp_path / "large.parquet"), tag_names=tag_names)
+
+    small = pq.read_table(tmp_path / "small.parquet")
+    large = pq.read_table(tmp_path / "large.parquet")
+    assert pa.types.is_list(small.schema.field("text").type)
+    assert pa.types.is_large_list(large.schema.field("text").type)
+    assert pa.types.is_large_list(large.schema.field("tags").type)
+    assert large.to_pydict() == small.to_pydict()
+    assert large.schema.metadata == small.schema.metadata